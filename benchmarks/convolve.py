@@ -0,0 +1,117 @@
+"""
+Micro-benchmark of single-filter convolutions (`Filter.convolve`).
+
+Reports the time per call, the peak temporary memory allocated per call
+(numpy buffers are traced by tracemalloc), and the number of allocations per
+call: the Python operations (also inside numpy's Python functions, e.g.
+np.trapz) after which the traced memory grew by at least 1 kB, i.e. that
+allocated a new array buffer. With --baseline, the convolution of before the
+log-space cache is timed instead: the old `log` and `interpolate_log`
+helpers, without the cached filter grids. Run from the repository root:
+
+    python -m benchmarks.convolve [--baseline]
+"""
+import sys
+import time
+import tracemalloc
+import numpy as np
+from scipy.constants import c
+from firenet.fluxing.filters import get_filter
+from firenet.fluxing.filters.helpers import combine_grids
+from benchmarks.synthetic import cigale_like_sed
+
+BANDS = ['GALEX_FUV', 'SDSS_r', '2MASS_Ks', 'WISE_12', 'PACS_100', 'SPIRE_250']
+# Smallest memory growth counted as an (array) allocation
+MIN_ALLOCATION = 1000
+
+def baseline_interpolate_log(x, xp, yp, logx=True, logy=True, **kwargs):
+    """The old `interpolate_log`"""
+
+    if logx:
+        x = np.log(x)
+        xp = np.log(xp)
+    if logy:
+        yp = baseline_log(yp)
+    interp = np.interp(x, xp, yp, **kwargs)
+    if logy:
+        interp = np.exp(interp)
+    return interp
+
+def baseline_log(x):
+    """The old `log`"""
+
+    zeromask = x<=0
+    logx = np.empty(x.shape)
+    logx[zeromask] = -750.
+    logx[~zeromask] = np.log(x[~zeromask])
+    return logx
+
+def baseline_convolve(filt, sed_wavelengths, sed_fnu):
+    """The old `Filter.convolve`, without the cached grids"""
+
+    if np.all(sed_fnu <= 0):
+        sed_fnu = -sed_fnu
+        signfact = -1
+    else:
+        signfact = 1
+    sed_freq = (c*1e6 / sed_wavelengths)[::-1]
+    sed_fnu = sed_fnu[::-1]
+    freqs = combine_grids(sed_freq, filt.frequencies)
+    sed = baseline_interpolate_log(freqs, sed_freq, sed_fnu)
+    transmission = baseline_interpolate_log(freqs, filt.frequencies,
+                                            filt.transmission, logy=False)
+    return signfact * (np.trapz(x=freqs, y=(sed * transmission)) /
+                       np.trapz(x=freqs, y=transmission))
+
+def count_allocations(func, *args):
+    """Number of operations in `func(*args)` that allocate at least 1 kB"""
+
+    counter = {'n': 0, 'memory': 0}
+
+    def trace(frame, event, arg):
+        frame.f_trace_opcodes = True
+        if event == 'opcode':
+            memory = tracemalloc.get_traced_memory()[0]
+            if memory - counter['memory'] >= MIN_ALLOCATION:
+                counter['n'] += 1
+            counter['memory'] = memory
+        return trace
+
+    tracemalloc.start()
+    counter['memory'] = tracemalloc.get_traced_memory()[0]
+    sys.settrace(trace)
+    try:
+        func(*args)
+    finally:
+        sys.settrace(None)
+        tracemalloc.stop()
+    return counter['n']
+
+def benchmark_convolve(convolve, filt, wavelengths, fnu, n_repeat=200):
+    convolve(filt, wavelengths, fnu)  # warm caches
+    start = time.perf_counter()
+    for _ in range(n_repeat):
+        convolve(filt, wavelengths, fnu)
+    duration = (time.perf_counter() - start) / n_repeat
+    tracemalloc.start()
+    convolve(filt, wavelengths, fnu)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    n_allocations = count_allocations(convolve, filt, wavelengths, fnu)
+    return duration, peak, n_allocations
+
+def main():
+    baseline = '--baseline' in sys.argv[1:]
+    convolve = baseline_convolve if baseline else type(get_filter(BANDS[0])).convolve
+    wavelengths, fnu = cigale_like_sed()
+    print(f'SED grid: {len(wavelengths)} points'
+          f'{" (baseline helpers)" if baseline else ""}')
+    print(f'{"filter":>10} {"time (us)":>10} {"peak temp. memory (kB)":>23} '
+          f'{"allocations":>12}')
+    for band in BANDS:
+        duration, peak, n_allocations = benchmark_convolve(
+            convolve, get_filter(band), wavelengths, fnu)
+        print(f'{band:>10} {duration*1e6:10.1f} {peak/1e3:23.1f} {n_allocations:12d}')
+
+if __name__ == '__main__':
+    main()
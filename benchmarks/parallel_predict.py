@@ -0,0 +1,49 @@
+"""
+Throughput scaling of the chunked catalogue prediction (`firenet.predict`)
+with the number of worker processes, from 1 to the number of CPUs.
+
+Uses a synthetic catalogue and an engine with random weights, so no trained
+model is needed, and keeps the output in memory, so only the prediction and
+the transfer of the chunks is measured. Run from the repository root:
+
+    python -m benchmarks.parallel_predict [n_galaxies] [chunksize]
+"""
+import os
+import sys
+import time
+import numpy as np
+from firenet.predict import CataloguePredictor, predict_chunks
+from benchmarks.synthetic import random_reguncengine, synthetic_catalogue
+
+def iter_chunks(catalogue, chunksize):
+    for start in range(0, len(catalogue), chunksize):
+        yield catalogue.iloc[start:start+chunksize]
+
+def benchmark(predictor, catalogue, chunksize, n_jobs):
+    start = time.perf_counter()
+    n_galaxies = 0
+    for predictions in predict_chunks(predictor, iter_chunks(catalogue, chunksize),
+                                      n_jobs=n_jobs):
+        n_galaxies += len(predictions)
+    duration = time.perf_counter() - start
+    assert n_galaxies == len(catalogue)
+    return n_galaxies / duration
+
+def main():
+    n_galaxies = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    chunksize = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+    catalogue = synthetic_catalogue(n_galaxies)
+    predictor = CataloguePredictor(random_reguncengine())
+    n_cpus = os.cpu_count() or 1
+    li_n_jobs = sorted(set([1] + [2**i for i in range(1, int(np.log2(n_cpus)) + 1)]
+                           + [n_cpus]))
+    print(f'{n_galaxies} galaxies, chunks of {chunksize}, {n_cpus} CPUs')
+    print(f'{"n_jobs":>7} {"galaxies/s":>12} {"speed-up":>9}')
+    reference = None
+    for n_jobs in li_n_jobs:
+        throughput = benchmark(predictor, catalogue, chunksize, n_jobs)
+        reference = reference or throughput
+        print(f'{n_jobs:>7} {throughput:12.0f} {throughput/reference:9.2f}')
+
+if __name__ == '__main__':
+    main()
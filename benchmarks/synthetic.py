@@ -0,0 +1,99 @@
+"""Synthetic inputs for the benchmarks, so they run without external data."""
+import numpy as np
+
+def cigale_like_sed(seed=0):
+    """
+    A smooth stellar + dust SED (wavelengths in micron, Fnu in Jy) on a grid
+    similar to a CIGALE best fit: 1 nm steps in the UV-optical and about 1%
+    steps from the near-infrared to the submm.
+    """
+
+    wavelengths = np.concatenate([np.arange(0.091, 0.95, 0.001),
+                                  np.logspace(np.log10(0.951), 4, 1000)])
+    freqs = 2.99792458e14 / wavelengths
+
+    def planck(temperature):
+        x = np.minimum(4.799e-11 * freqs / temperature, 700)
+        return freqs**3 / np.expm1(x)
+
+    rng = np.random.default_rng(seed)
+    fnu = (planck(5000) * 1e-9 * (1 + 0.3 * np.sin(wavelengths * 50) * (wavelengths < 1))
+           + planck(25) * freqs**2 * 1e-25
+           + 1e-3 * np.exp(-0.5 * ((wavelengths - 7.7) / 0.3)**2))
+    return wavelengths, fnu * rng.uniform(0.5, 2)
+
+def synthetic_d_data(n_galaxies=4333, seed=0):
+    """
+    A `d_data` dict with the size of the H-ATLAS + DustPedia set: 'shortbay',
+    'observed' and 'observederr' (W/Hz), with about 10% missing observed
+    fluxes, as in the CIGALE input tables.
+    """
+
+    import pandas as pd
+    from firenet.ingest import COLMAP
+
+    rng = np.random.default_rng(seed)
+    bands = list(COLMAP.values())
+    index = pd.Index([f'G{i}' for i in range(n_galaxies)], name='id')
+    shortbay = 10**rng.normal(21, 1, size=(n_galaxies, len(bands)))
+    observed = shortbay * 10**rng.normal(0, 0.1, size=shortbay.shape)
+    observed[rng.uniform(size=shortbay.shape) < 0.1] = np.nan
+    observederr = np.abs(observed) * rng.uniform(0.02, 0.3, size=shortbay.shape)
+    return {name: pd.DataFrame(values, index=index, columns=bands)
+            for name, values in [('shortbay', shortbay), ('observed', observed),
+                                 ('observederr', observederr)]}
+
+def synthetic_training_d_data(n_galaxies=4333, seed=0):
+    """
+    `synthetic_d_data` with a 'fullbay' target, whose FIR fluxes are a
+    nonlinear function of the UV-MIR fluxes plus 0.1 dex noise (so there is
+    something to learn), and the uncertainty features. For training benchmarks.
+    """
+
+    import pandas as pd
+    from firenet.ml.preprocessing import FeatureSelect
+    from firenet.util import add_uncertainty_features
+
+    d_data = synthetic_d_data(n_galaxies, seed=seed)
+    rng = np.random.default_rng(seed + 1)
+    logflux = np.log10(d_data['shortbay'][FeatureSelect.uvmir_bands].values)
+    logflux = logflux - logflux.mean(axis=0)
+    weights = rng.normal(0, 0.3, size=(logflux.shape[1], len(FeatureSelect.fir_bands)))
+    logfir = (21 + np.tanh(logflux @ weights) + 0.2 * logflux[:, -1:]
+              + rng.normal(0, 0.1, size=(len(logflux), len(FeatureSelect.fir_bands))))
+    fullbay = d_data['shortbay'].copy()
+    fullbay[FeatureSelect.fir_bands] = 10**logfir
+    d_data['fullbay'] = fullbay
+    return add_uncertainty_features(d_data)
+
+def random_reguncengine(hidden_layer_sizes=(100, 100), seed=0):
+    """
+    A `RegUncEngine` with random weights and the default architectures
+    (14 -> 100 -> 100 -> 6 and 42 -> 100 -> 100 -> 6, softplus output for
+    the uncertainty estimator), to benchmark inference without a trained model.
+    """
+
+    from firenet.ml.inference import MLPEngine, RegUncEngine
+
+    rng = np.random.default_rng(seed)
+
+    def random_engine(n_in, output_activation):
+        arch = [n_in] + list(hidden_layer_sizes) + [6]
+        weights = [rng.normal(0, 1 / np.sqrt(n_in), size=(n_in, n_out))
+                   for n_in, n_out in zip(arch[:-1], arch[1:])]
+        biases = [np.zeros(n_out) for n_out in arch[1:]]
+        activations = [('ReLU', {})] * (len(weights) - 1) + [output_activation]
+        return MLPEngine(weights, biases, activations)
+
+    return RegUncEngine(random_engine(14, None), random_engine(42, ('Softplus', {})))
+
+def synthetic_catalogue(n_galaxies=100000, seed=0):
+    """A flux catalogue in the input format of `firenet.predict`"""
+
+    import pandas as pd
+
+    d_data = synthetic_d_data(n_galaxies, seed=seed)
+    catalogue = pd.concat([d_data[simname].add_prefix(f'{simname}_')
+                           for simname in ['shortbay', 'observed', 'observederr']],
+                          axis=1)
+    return catalogue
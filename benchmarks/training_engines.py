@@ -0,0 +1,69 @@
+"""
+Wall-clock time of training the regressor and uncertainty estimator with each
+training engine of `default_skorch_nnet` ('minibatch', 'fullbatch', 'lbfgs'),
+and the validation/test RMSE and mean chi^2 they reach.
+
+For the regressor, 'to target' is the time until the validation loss first
+reaches the best validation loss of the minibatch engine. The uncertainty
+estimator is not corrected to unit validation chi^2, so its mean chi^2 shows
+how well it is fit. Uses synthetic data of the size of the H-ATLAS +
+DustPedia set. Run from the repository root:
+
+    python -m benchmarks.training_engines [n_galaxies]
+"""
+import sys
+import tempfile
+import time
+import numpy as np
+import torch
+from firenet.ml import RegUncPredictor
+from firenet.ml.modelbuilder import TRAINING_ENGINES
+from benchmarks.synthetic import synthetic_training_d_data
+
+def time_to_target(history, target):
+    """Summed epoch durations until the validation loss reaches target"""
+
+    durations = np.array(history[:, 'dur'])
+    reached = np.nonzero(np.array(history[:, 'valid_loss']) <= target)[0]
+    return durations[:reached[0] + 1].sum() if len(reached) > 0 else np.nan
+
+def benchmark(d_data, engine, checkpoint_dir, target=None):
+    torch.manual_seed(0)
+    predictor = RegUncPredictor(d_data)
+    predictor.preprocess()
+    start = time.perf_counter()
+    predictor.train_regressor(engine=engine, verbose=False,
+                              f_checkpoint=f'{checkpoint_dir}/{engine}_reg.pt')
+    reg_time = time.perf_counter() - start
+    start = time.perf_counter()
+    predictor.train_uncertainty(engine=engine, verbose=False, apply_correction=False,
+                                f_checkpoint=f'{checkpoint_dir}/{engine}_unc.pt')
+    unc_time = time.perf_counter() - start
+    history = predictor.reg.model.named_steps['neuralnet_scaled'].regressor_.history
+    best_valid = min(history[:, 'valid_loss'])
+    target = best_valid if target is None else target
+    return {'reg_time': reg_time, 'reg_to_target': time_to_target(history, target),
+            'best_valid': best_valid,
+            'val_rmse': predictor.reg.test(tset='val').mean(),
+            'test_rmse': predictor.reg.test().mean(), 'unc_time': unc_time,
+            'val_chisq': predictor.unc.test(tset='val').mean(),
+            'test_chisq': predictor.unc.test().mean()}
+
+def main():
+    n_galaxies = int(sys.argv[1]) if len(sys.argv) > 1 else 4333
+    d_data = synthetic_training_d_data(n_galaxies)
+    print(f'{n_galaxies} galaxies')
+    print(f'{"engine":>10} {"reg (s)":>8} {"to target":>10} {"val rmse":>9} '
+          f'{"test rmse":>10} {"unc (s)":>8} {"val chi2":>9} {"test chi2":>10}')
+    target = None
+    with tempfile.TemporaryDirectory() as checkpoint_dir:
+        for engine in TRAINING_ENGINES:
+            res = benchmark(d_data, engine, checkpoint_dir, target)
+            target = target or res['best_valid']
+            print(f'{engine:>10} {res["reg_time"]:8.1f} {res["reg_to_target"]:10.1f} '
+                  f'{res["val_rmse"]:9.4f} {res["test_rmse"]:10.4f} '
+                  f'{res["unc_time"]:8.1f} {res["val_chisq"]:9.3f} '
+                  f'{res["test_chisq"]:10.3f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""
+Training speed (epochs per second) of the default skorch networks with the
+DataLoader batches and with the in-memory tensor batches
+(`default_skorch_nnet(batch_iterator='tensor')`).
+
+Uses random data of the size of the training set of notebook 04, without
+checkpointing. Run from the repository root:
+
+    python -m benchmarks.training_epochs [n_galaxies] [max_epochs]
+"""
+import sys
+import time
+import numpy as np
+import torch
+from firenet.ml.modelbuilder import default_skorch_nnet
+
+def benchmark(reg, X, y, max_epochs, batch_iterator):
+    torch.manual_seed(0)
+    net = default_skorch_nnet(reg=reg, insize=X.shape[1], outsize=y.shape[1],
+                              checkpoint=False, verbose=False, max_epochs=max_epochs,
+                              batch_iterator=batch_iterator)
+    start = time.perf_counter()
+    net.fit(X, y)
+    duration = time.perf_counter() - start
+    return max_epochs / duration, net.history[-1, 'valid_loss']
+
+def main():
+    n_galaxies = int(sys.argv[1]) if len(sys.argv) > 1 else 3500
+    max_epochs = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    rng = np.random.RandomState(0)
+    print(f'{n_galaxies} galaxies, {max_epochs} epochs')
+    print(f'{"net":>4} {"iterator":>11} {"epochs/s":>9} {"speed-up":>9} {"valid_loss":>11}')
+    for reg, n_in in [(True, 14), (False, 42)]:
+        X = rng.normal(size=(n_galaxies, n_in)).astype(np.float32)
+        y = rng.normal(size=(n_galaxies, 6)).astype(np.float32)
+        if not reg:
+            y = np.abs(y)
+        reference = None
+        for batch_iterator in ['dataloader', 'tensor']:
+            speed, loss = benchmark(reg, X, y, max_epochs, batch_iterator)
+            reference = reference or speed
+            print(f'{"reg" if reg else "unc":>4} {batch_iterator:>11} {speed:9.1f} '
+                  f'{speed/reference:9.2f} {loss:11.6f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Benchmark of the uncertainty estimator features: `add_uncertainty_features`
+followed by `FeatureSelect.select_xunc` (the 42-feature matrix), against the
+previous pandas implementation.
+
+Uses the H-ATLAS + DustPedia set if its CIGALE tables are in ./data, and a
+synthetic set of the same size otherwise. Run from the repository root:
+
+    python -m benchmarks.uncertainty_features
+"""
+import time
+import numpy as np
+import pandas as pd
+from firenet.galaxytable import GalaxyTable
+from firenet.ingest import load_d_data
+from firenet.ml.preprocessing import FeatureSelect
+from firenet.util import add_uncertainty_features
+from benchmarks.synthetic import synthetic_d_data
+
+def pandas_features(d_data):
+    """The previous implementation, for reference"""
+
+    def log_ratio(df):
+        return df.copy().replace([np.inf, -np.inf], np.nan).apply(np.log10).fillna(6)
+    d_data['obserr_to_short'] = log_ratio(d_data['observederr'] / d_data['shortbay'])
+    d_data['obs_to_short'] = log_ratio(d_data['observed'] / d_data['shortbay'])
+    df = FeatureSelect.add_features(None, d_data, FeatureSelect.uvmir_bands, 'shortbay')
+    df = FeatureSelect.add_features(df, d_data, FeatureSelect.uvmir_bands, 'obs_to_short')
+    return FeatureSelect.add_features(df, d_data, FeatureSelect.uvmir_bands,
+                                      'obserr_to_short')
+
+def numpy_features(d_data):
+    return FeatureSelect.select_xunc(add_uncertainty_features(d_data))
+
+def timeit(func, d_data, n_repeat=20):
+    func(dict(d_data))  # warm up
+    start = time.perf_counter()
+    for _ in range(n_repeat):
+        result = func(dict(d_data))
+    return (time.perf_counter() - start) / n_repeat, result
+
+def main():
+    try:
+        d_data = load_d_data()
+        source = 'H-ATLAS + DustPedia'
+    except FileNotFoundError:
+        d_data = synthetic_d_data()
+        source = 'synthetic'
+    d_data = {name: d_data[name] for name in ['shortbay', 'observed', 'observederr']}
+    print(f'{source} set: {len(d_data["shortbay"])} galaxies')
+    t_pandas, ref = timeit(pandas_features, d_data)
+    t_numpy, result = timeit(numpy_features, d_data)
+    pd.testing.assert_frame_equal(ref, result)
+    table = GalaxyTable.from_dict(d_data, index=d_data['shortbay'].index)
+    t_table, result = timeit(lambda _: FeatureSelect.select_xunc(table), d_data)
+    pd.testing.assert_frame_equal(ref, result)
+    print(f'{"implementation":>32} {"time (ms)":>10}')
+    print(f'{"pandas (previous)":>32} {t_pandas*1e3:10.2f}')
+    print(f'{"numpy kernel (dict)":>32} {t_numpy*1e3:10.2f}')
+    print(f'{"select_xunc (GalaxyTable)":>32} {t_table*1e3:10.2f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Loading directories of CIGALE best-fit model SEDs (one FITS file per galaxy).
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import numpy as np
+from .sed import HighresSED
+
+def iter_cigale_fits(directory, suffix='_best_fit.fits', n_threads=None,
+                     **fits_kwargs):
+    """
+    Iterate over the CIGALE best fits in a directory, yielding
+    (galaxy name, HighresSED) in sorted file order.
+
+    Each file is memory-mapped, only the needed columns are read, and it is
+    closed right after (see `HighresSED.from_cigale_fits`).
+
+    Parameters
+    ----------
+    directory : path
+        Directory with the `<name><suffix>` files.
+    suffix : string, default '_best_fit.fits'
+    n_threads : int or None, default None
+        If given, read the files in a pool of this many threads. At most
+        2 * n_threads files are read ahead of the consumer.
+    fits_kwargs : keyword arguments passed to `HighresSED.from_cigale_fits`
+        (flux_column, fluxfactor, hdu_index, combine_column_list)
+    """
+
+    filenames = sorted(Path(directory).glob('*' + suffix))
+
+    def read(filename):
+        return HighresSED.from_cigale_fits(filename, **fits_kwargs)
+
+    if n_threads is None:
+        for filename in filenames:
+            yield filename.name[:-len(suffix)], read(filename)
+        return
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        queue = deque()
+        for filename in filenames:
+            queue.append((filename, executor.submit(read, filename)))
+            if len(queue) >= 2 * n_threads:
+                filename, future = queue.popleft()
+                yield filename.name[:-len(suffix)], future.result()
+        while queue:
+            filename, future = queue.popleft()
+            yield filename.name[:-len(suffix)], future.result()
+
+def load_cigale_fits(directory, suffix='_best_fit.fits', n_threads=None,
+                     dtype=np.float64, **fits_kwargs):
+    """
+    Load all CIGALE best fits in a directory as one 2-dimensional array. All
+    models should share one wavelength grid.
+
+    Parameters: see `iter_cigale_fits`, and
+    dtype : numpy dtype, default np.float64
+        The dtype of the returned fluxes.
+
+    Returns
+    -------
+    names : list of strings, length n_galaxies
+    wavelengths : array, shape (n_wavelengths,)
+        The shared wavelength grid (micron).
+    fnu : array, shape (n_galaxies, n_wavelengths)
+        The fluxes (Jy). Can be passed to `HighresSED.to_broadband_array`.
+    """
+
+    n_files = len(list(Path(directory).glob('*' + suffix)))
+    names, wavelengths, fnu = [], None, None
+    for i, (name, sed) in enumerate(iter_cigale_fits(directory, suffix, n_threads,
+                                                     **fits_kwargs)):
+        if not isinstance(sed, HighresSED):
+            raise ValueError('Stacking requires one SED per file, set '
+                             'combine_column_list=True')
+        if wavelengths is None:
+            wavelengths = sed.wavelengths
+            fnu = np.empty((n_files, len(wavelengths)), dtype=dtype)
+        elif not np.array_equal(sed.wavelengths, wavelengths):
+            raise ValueError(f'The wavelength grid of {name} differs from the '
+                             'other models')
+        names.append(name)
+        fnu[i] = sed.fnu
+    return names, wavelengths, fnu
@@ -1 +1,3 @@
-from .filter import *
\ No newline at end of file
+from .filter import *
+from .filterbank import *
+from .convolver import *
\ No newline at end of file
@@ -0,0 +1,103 @@
+import numpy as np
+from scipy.constants import c
+from .filterbank import get_filter
+from .helpers import combine_grids, interpolate_log, grid_key, LRUCache
+
+class FilterSetConvolver:
+    """
+    Convolves SEDs on a fixed wavelength grid with a set of filters, as a
+    single matrix product.
+
+    For each filter, the integral of `Filter.convolve` is written as a row of
+    weights over the SED grid, so broadband fluxes are `weights @ fnu`. The
+    filter side (the combined grid, the interpolated transmission and the
+    trapezoid weights) is identical to `Filter.convolve`. The only difference
+    is that the SED is interpolated linearly in log(frequency) between its own
+    grid points, instead of in log(flux). This makes the result linear in the
+    SED. For smooth SEDs sampled at CIGALE resolution, the relative difference
+    with `Filter.convolve` is below 1e-3 (and zero where the filter curve is
+    sampled on the SED grid points only).
+    """
+
+    # (wavelength grid, filters) -> FilterSetConvolver
+    _cache = LRUCache(maxsize=32)
+
+    def __init__(self, wavelengths, filters):
+        self.wavelengths = np.array(wavelengths, dtype=np.float64)
+        self.filters = [get_filter(filt) for filt in filters]
+        self.weights = np.vstack([self._get_filter_weights(filt)
+                                  for filt in self.filters])
+        self.weights.flags.writeable = False
+
+    @classmethod
+    def get(cls, wavelengths, filters):
+        """Get a (cached) convolver for this wavelength grid and filter set"""
+
+        filters = tuple(get_filter(filt) for filt in filters)
+        key = (grid_key(wavelengths), filters)
+        if key not in cls._cache:
+            cls._cache[key] = cls(wavelengths, filters)
+        return cls._cache[key]
+
+    def convolve(self, fnu, out=None, chunksize=4096):
+        """
+        Broadband fluxes of SED(s) on this wavelength grid.
+
+        Parameters
+        ----------
+        fnu : array, shape (n_wavelengths,) or (n_seds, n_wavelengths)
+            The SED(s). The result has shape (n_filters,) or
+            (n_seds, n_filters). Since the convolution is linear, an
+            all-negative (attenuation) SED gives minus the convolution of its
+            absolute value, which matches the sign flip in `Filter.convolve`
+            for every row separately.
+        out : array or None, default None
+            Array of shape (n_seds, n_filters) to write 2-dimensional results
+            into.
+        chunksize : int, default 4096
+            Number of SEDs per matrix product, which bounds the temporary
+            memory when `fnu` needs casting (e.g. float32 libraries).
+        """
+
+        fnu = np.asarray(fnu)
+        if fnu.shape[-1] != len(self.wavelengths):
+            raise ValueError(f'SED has {fnu.shape[-1]} wavelengths, convolver '
+                             f'expects {len(self.wavelengths)}')
+        if fnu.ndim == 1:
+            return self.weights @ fnu
+        if out is None:
+            out = np.empty((len(fnu), len(self.filters)),
+                           dtype=np.result_type(fnu.dtype, self.weights.dtype))
+        weights_t = self.weights.T
+        for start in range(0, len(fnu), chunksize):
+            stop = start + chunksize
+            np.matmul(fnu[start:stop], weights_t, out=out[start:stop])
+        return out
+
+    def _get_filter_weights(self, filt):
+        """Weights of the SED grid points (wavelength order) for one filter"""
+
+        sed_freq = (c*1e6 / self.wavelengths)[::-1]
+        freqs = combine_grids(sed_freq, filt.frequencies)
+        log_freqs = np.log(freqs)
+        transmission = interpolate_log(log_freqs, filt.log_frequencies(),
+                                       filt.transmission, logx=False, logy=False)
+        # Trapezoid weights of the combined grid, normalised by the
+        # transmission integral (as in Filter.convolve)
+        dfreq = np.diff(freqs)
+        trapz_weights = np.zeros(len(freqs))
+        trapz_weights[:-1] += dfreq / 2
+        trapz_weights[1:] += dfreq / 2
+        node_weights = trapz_weights * transmission
+        node_weights /= np.sum(node_weights)
+        # Each combined grid point lies between SED points j and j+1
+        log_sed_freq = np.log(sed_freq)
+        idx = np.searchsorted(sed_freq, freqs, side='right') - 1
+        idx = np.clip(idx, 0, len(sed_freq) - 2)
+        frac = ((log_freqs - log_sed_freq[idx]) /
+                (log_sed_freq[idx+1] - log_sed_freq[idx]))
+        weights = (np.bincount(idx, weights=node_weights * (1 - frac),
+                               minlength=len(sed_freq)) +
+                   np.bincount(idx + 1, weights=node_weights * frac,
+                               minlength=len(sed_freq)))
+        return weights[::-1]
@@ -1,4 +1,6 @@
-from .helpers import combine_grids, interpolate_log, cache_simple_method
+from .helpers import (combine_grids, interpolate_log, cache_simple_method,
+                      grid_key, LRUCache)
+from .filterstore import FilterStore
 import os
 from pathlib import Path
 import numpy as np
@@ -10,11 +12,29 @@ class Filter:
     """Class that represents a single broad-band filter"""
 
     filterdir = Path(__file__).parent / 'filterdata'
+    # Compiled binary version of filterdir (see filterstore.py)
+    storefile = Path(__file__).parent / 'filterdata.npz'
+    _d_namemap = None  # lowercase name -> filename, filled on first use
+    _store = None  # FilterStore, or False if there is no (up to date) store
 
     def __init__(self, filtername):
         self.name = filtername
         filename = self._get_filterfile(filtername)
-        self.get_transmission(filename)
+        store = Filter._get_store()
+        if store and (filename in store):
+            self._set_from_store(store.get(filename))
+        else:
+            self.get_transmission(filename)
+
+    @classmethod
+    def from_file(cls, filename, name=None):
+        """Create a filter by parsing its file, bypassing the filter store"""
+
+        filename = Path(filename)
+        filt = cls.__new__(cls)
+        filt.name = name if name is not None else filename.stem
+        filt.get_transmission(filename)
+        return filt
 
     def get_transmission(self, filename):
         '''
@@ -35,6 +55,7 @@ class Filter:
                 if i == 1:
                     det_type = line[1:].strip()
         skiplines = i
+        self.det_type = det_type
         df_filter = pd.read_csv(filename, skiprows=skiplines, header=None,
                                 sep=r'\s+', 
                                 names=['wavelength', 'transmission'],
@@ -48,6 +69,17 @@ class Filter:
         self.transmission = self._trans_lambda[::-1]
         self.transmission /= np.trapz(x=self.frequencies, y=self.transmission)
 
+    def _set_from_store(self, d_curve):
+        """Set the (memory-mapped) curve from the filter store"""
+
+        self.det_type = d_curve['det_type']
+        self.wavelengths = d_curve['wavelengths']
+        self.frequencies = d_curve['frequencies']
+        self.transmission = d_curve['transmission']
+        self._trans_lambda = self.transmission[::-1]
+        self._cache = {'pivot_wavelength': d_curve['pivot_wavelength'],
+                       'effective_wavelength': d_curve['effective_wavelength']}
+
     def convolve(self, sed_wavelengths, sed_fnu):
         '''
         Apply the filter to the sed
@@ -61,15 +93,43 @@ class Filter:
         else:
             signfact = 1
         
+        grid = self._get_combined_grid(sed_wavelengths)
+        sed = interpolate_log(grid['log_freqs'], grid['log_sed_freq'],
+                              sed_fnu[::-1][grid['sed_slice']], logx=False)
+        return signfact * (np.trapz(x=grid['freqs'],
+                                    y=np.multiply(sed, grid['transmission'], out=sed)) /
+                           grid['norm'])
+
+    def _get_combined_grid(self, sed_wavelengths):
+        """
+        The combined (SED + filter) frequency grid, its log, the transmission
+        on it, and the SED points needed to interpolate on it. Cached for the
+        last few SED grids.
+        """
+
+        if not hasattr(self, '_grid_cache'):
+            self._grid_cache = LRUCache(maxsize=8)
+        key = grid_key(sed_wavelengths)
+        if key in self._grid_cache:
+            return self._grid_cache[key]
         sed_freq = (c*1e6 / sed_wavelengths)[::-1]
-        sed_fnu = sed_fnu[::-1]
         freqs = combine_grids(sed_freq, self.frequencies)
-        sed = interpolate_log(freqs, sed_freq, sed_fnu)
-        transmission = interpolate_log(freqs, self.frequencies, 
-                                       self.transmission, logy=False)
-        # Normalize again because of finer grid
-        return signfact * (np.trapz(x=freqs, y=(sed * transmission)) /
-                           np.trapz(x=freqs, y=transmission))
+        # Interpolate in logspace, reusing log(freqs) and the cached log of
+        # the filter frequencies
+        log_freqs = np.log(freqs)
+        transmission = interpolate_log(log_freqs, self.log_frequencies(),
+                                       self.transmission, logx=False, logy=False)
+        # Only the SED points around the filter are used for interpolation
+        start = max(np.searchsorted(sed_freq, freqs[0], side='right') - 1, 0)
+        stop = np.searchsorted(sed_freq, freqs[-1]) + 1
+        sed_slice = slice(start, stop)
+        grid = {'freqs': freqs, 'log_freqs': log_freqs, 'sed_slice': sed_slice,
+                'log_sed_freq': np.log(sed_freq[sed_slice]),
+                'transmission': transmission,
+                # Normalize again because of finer grid
+                'norm': np.trapz(x=freqs, y=transmission)}
+        self._grid_cache[key] = grid
+        return grid
 
     def convolve_lambda(self, sed_wavelengths, sed_flambda):
         '''
@@ -85,6 +145,10 @@ class Filter:
                        np.trapz(x=lambdas, y=(c * transmission / 
                                               np.square(lambdas))))
 
+    @cache_simple_method
+    def log_frequencies(self):
+        return np.log(self.frequencies)
+
     @cache_simple_method
     def effective_wavelength(self):
         return (np.trapz(x=self.wavelengths, 
@@ -109,12 +173,11 @@ class Filter:
         ax.set_title(self.name)
         return f
 
-    def _get_filterfile(self, filtername):
+    @staticmethod
+    def _get_filterfile(filtername):
         """Resolve filter name to get to the right file"""
 
-        rawnames = os.listdir(Filter.filterdir)
-        validnames = list(map(lambda x: x.lower()[:-4], rawnames))
-        d_namemap = {validnames[i]: rawnames[i] for i in range(len(rawnames))}
+        d_namemap = Filter._get_namemap()
         originalname = filtername
         filtername = filtername.lower()
         if filtername.startswith('sdss_'):
@@ -145,8 +208,29 @@ class Filter:
             if last in dmap:
                 filtername = dmap[last]
 
-        if filtername in validnames:
+        if filtername in d_namemap:
             return d_namemap[filtername]
         else:
             raise ValueError('Filter {} '.format(originalname) +
-                             'was not found!')
\ No newline at end of file
+                             'was not found!')
+
+    @staticmethod
+    def _get_store():
+        """The compiled filter store, if it exists and is up to date"""
+
+        if Filter._store is None:
+            if FilterStore.is_stale(Filter.storefile, Filter.filterdir):
+                Filter._store = False
+            else:
+                Filter._store = FilterStore(Filter.storefile)
+        return Filter._store
+
+    @staticmethod
+    def _get_namemap():
+        """Map of valid (lowercase) filter names to filenames, listed once"""
+
+        if Filter._d_namemap is None:
+            rawnames = os.listdir(Filter.filterdir)
+            Filter._d_namemap = {rawname.lower()[:-4]: rawname
+                                 for rawname in rawnames}
+        return Filter._d_namemap
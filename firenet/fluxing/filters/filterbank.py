@@ -0,0 +1,75 @@
+from threading import Lock
+from .filter import Filter
+
+class FilterBank:
+    """
+    Registry of `Filter`s, so each transmission curve is read at most once.
+
+    Names are resolved to a filter file once, and every name that resolves to
+    the same file (e.g. 'PACS_70' and 'PACS_blue') gets the same `Filter`.
+    The returned filters are shared, so their arrays are made read-only.
+    """
+
+    def __init__(self):
+        self._d_filters = {}  # filename -> Filter
+        self._d_names = {}  # requested name -> filename
+        self._lock = Lock()
+
+    def __getitem__(self, filtername):
+        return self.get(filtername)
+
+    def __contains__(self, filtername):
+        return filtername in self._d_names
+
+    def __len__(self):
+        return len(self._d_filters)
+
+    def get(self, filt):
+        """
+        Get the shared `Filter` for a name. If `filt` is already a `Filter`,
+        it is returned as is.
+        """
+
+        if isinstance(filt, Filter):
+            return filt
+        filename = self._d_names.get(filt)
+        if filename is None:
+            # Raises ValueError for unknown filters
+            filename = Filter._get_filterfile(filt)
+        with self._lock:
+            if filename not in self._d_filters:
+                filterobj = Filter(filt)
+                self._freeze(filterobj)
+                self._d_filters[filename] = filterobj
+            self._d_names[filt] = filename
+            return self._d_filters[filename]
+
+    def preload(self, filternames):
+        """
+        Load a set of filters in one call, e.g.
+        ``bank.preload(FeatureSelect.uvmir_bands + FeatureSelect.fir_bands)``.
+        Returns the list of `Filter`s.
+        """
+
+        return [self.get(filtername) for filtername in filternames]
+
+    def clear(self):
+        """Forget all loaded filters"""
+
+        with self._lock:
+            self._d_filters.clear()
+            self._d_names.clear()
+
+    @staticmethod
+    def _freeze(filterobj):
+        for array in (filterobj.wavelengths, filterobj.frequencies,
+                      filterobj._trans_lambda, filterobj.transmission):
+            array.flags.writeable = False
+
+# Process-wide registry, used when filters are given as strings
+default_filterbank = FilterBank()
+
+def get_filter(filt):
+    """Get a shared `Filter` from the process-wide `FilterBank`"""
+
+    return default_filterbank.get(filt)
@@ -0,0 +1,135 @@
+"""
+Precompiled binary store of all filter curves.
+
+Parsing the ASCII curves in `filterdata` with pandas dominates the start-up
+time of short-lived processes. `compile_filterstore` writes all curves into a
+single (uncompressed) .npz archive, which `FilterStore` memory-maps, so no
+text is parsed and forked workers share the pages. Build it with
+
+    python -m firenet.fluxing.filters.filterstore
+
+and rebuild it after changing `filterdata` (a stale store is ignored).
+"""
+import struct
+import zipfile
+from pathlib import Path
+import numpy as np
+
+# Concatenated curves, memory-mapped when loading
+MAPPED_ARRAYS = ['wavelengths', 'frequencies', 'transmission']
+
+class FilterStore:
+    """Read-only access to the filter curves in a compiled .npz archive"""
+
+    def __init__(self, filename):
+        self.filename = Path(filename)
+        with zipfile.ZipFile(self.filename) as zipf:
+            d_arrays = {name: self._memmap_member(zipf, name + '.npy')
+                        for name in MAPPED_ARRAYS}
+        with np.load(self.filename) as npz:
+            names = list(npz['names'])
+            offsets = npz['offsets']
+            det_types = npz['det_type']
+            pivots = npz['pivot']
+            effectives = npz['effective']
+        self._d_index = {}
+        for i, name in enumerate(names):
+            start, stop = offsets[i], offsets[i+1]
+            self._d_index[name] = {
+                'det_type': str(det_types[i]),
+                'pivot_wavelength': float(pivots[i]),
+                'effective_wavelength': float(effectives[i]),
+                **{arrname: arr[start:stop] for arrname, arr in d_arrays.items()}}
+
+    def __contains__(self, filename):
+        return filename in self._d_index
+
+    def __len__(self):
+        return len(self._d_index)
+
+    def get(self, filename):
+        """
+        Get the curve of a filter file, as a dict with the (read-only)
+        wavelengths (micron, ascending), frequencies (Hz, ascending),
+        frequency-normalised transmission (matching frequencies), det_type,
+        pivot_wavelength and effective_wavelength.
+        """
+
+        if filename not in self._d_index:
+            raise ValueError(f'Filter file {filename} is not in the store!')
+        return self._d_index[filename]
+
+    @staticmethod
+    def is_stale(storefile, filterdir):
+        """True if a filter file in `filterdir` is newer than `storefile`"""
+
+        storefile, filterdir = Path(storefile), Path(filterdir)
+        if not storefile.exists():
+            return True
+        store_mtime = storefile.stat().st_mtime
+        return any(path.stat().st_mtime > store_mtime
+                   for path in filterdir.glob('*.dat'))
+
+    def _memmap_member(self, zipf, member):
+        info = zipf.getinfo(member)
+        if info.compress_type != zipfile.ZIP_STORED:
+            raise ValueError(f'{self.filename} is compressed, cannot memory-map')
+        with self.filename.open('rb') as f:
+            # The array starts after the local file header of the zip member
+            f.seek(info.header_offset)
+            header = f.read(30)
+            namelen, extralen = struct.unpack('<HH', header[26:30])
+            f.seek(info.header_offset + 30 + namelen + extralen)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            offset = f.tell()
+        order = 'F' if fortran_order else 'C'
+        return np.memmap(self.filename, dtype=dtype, mode='r', shape=shape,
+                         offset=offset, order=order)
+
+def compile_filterstore(storefile=None, filterdir=None):
+    """
+    Parse all filter curves and write them into a single .npz archive.
+
+    Parameters
+    ----------
+    storefile : path or None, default None
+        The archive to write. If None, use `Filter.storefile`.
+    filterdir : path or None, default None
+        Directory with the .dat filter curves. If None, use `Filter.filterdir`.
+    """
+
+    from .filter import Filter
+
+    storefile = Path(storefile) if storefile is not None else Filter.storefile
+    filterdir = Path(filterdir) if filterdir is not None else Filter.filterdir
+    names, det_types, pivots, effectives = [], [], [], []
+    d_curves = {arrname: [] for arrname in MAPPED_ARRAYS}
+    for path in sorted(filterdir.glob('*.dat')):
+        filt = Filter.from_file(path)
+        names.append(path.name)
+        det_types.append(filt.det_type)
+        # Some pseudo filters have no valid pivot wavelength (nan)
+        with np.errstate(invalid='ignore'):
+            pivots.append(filt.pivot_wavelength())
+            effectives.append(filt.effective_wavelength())
+        for arrname in MAPPED_ARRAYS:
+            d_curves[arrname].append(getattr(filt, arrname))
+    lengths = [len(wavelengths) for wavelengths in d_curves['wavelengths']]
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    # np.savez does not compress, so the curves can be memory-mapped
+    with storefile.open('wb') as outf:
+        np.savez(outf, names=np.array(names), offsets=offsets,
+                 det_type=np.array(det_types), pivot=np.array(pivots),
+                 effective=np.array(effectives),
+                 **{arrname: np.concatenate(li_arr).astype(np.float64)
+                    for arrname, li_arr in d_curves.items()})
+    return storefile
+
+if __name__ == '__main__':
+    import sys
+    storefile = compile_filterstore(*sys.argv[1:2])
+    print(f'Filter store written to {storefile}')
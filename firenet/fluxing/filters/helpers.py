@@ -1,19 +1,57 @@
+from collections import OrderedDict
 from functools import wraps
+import hashlib
 import numpy as np
 
-def combine_grids(ga, gb):
-    '''Combines 2 grids into one (all points of both are preserved)'''
+def combine_grids(ga, gb, assume_sorted=None):
+    '''
+    Combines 2 grids into one (all points of both are preserved)
+
+    If both grids are sorted in ascending order, they are clipped with a
+    binary search and merged, instead of stacked and sorted. Whether they are
+    sorted is checked, unless `assume_sorted` is given.
+    '''
 
     if (ga[-1] < gb[0]) or (gb[-1] < ga[0]):
         raise ValueError('Grid a and b are incompatible!')
-    ga = np.array(ga)
-    gb = np.array(gb)
-    g1 = ga[(ga >= gb[0]) & (ga <= gb[-1])]
-    g2 = gb[(gb >= ga[0]) & (gb <= ga[-1])]
-    return np.sort(np.unique(np.hstack((g1, g2))))
+    ga = np.asarray(ga)
+    gb = np.asarray(gb)
+    if assume_sorted is None:
+        assume_sorted = is_sorted(ga) and is_sorted(gb)
+    if not assume_sorted:
+        g1 = ga[(ga >= gb[0]) & (ga <= gb[-1])]
+        g2 = gb[(gb >= ga[0]) & (gb <= ga[-1])]
+        return np.sort(np.unique(np.hstack((g1, g2))))
+    g1 = ga[np.searchsorted(ga, gb[0]):np.searchsorted(ga, gb[-1], side='right')]
+    g2 = gb[np.searchsorted(gb, ga[0]):np.searchsorted(gb, ga[-1], side='right')]
+    return merge_sorted(g1, g2)
+
+def merge_sorted(ga, gb):
+    '''Merge two sorted grids into one sorted grid without duplicates'''
+
+    merged = np.concatenate((ga, gb))
+    if len(merged) == 0:
+        return merged
+    # Timsort detects the two sorted runs and merges them in linear time
+    merged.sort(kind='stable')
+    keep = np.empty(len(merged), dtype=bool)
+    keep[0] = True
+    np.not_equal(merged[1:], merged[:-1], out=keep[1:])
+    return merged[keep]
+
+def is_sorted(grid):
+    '''True if the grid is sorted in ascending order'''
+
+    return bool(np.all(grid[1:] >= grid[:-1]))
+
+def interpolate_log(x, xp, yp, logx=True, logy=True, out=None, **kwargs):
+    '''
+    Interpolate in logspace (useful for SEDs)
 
-def interpolate_log(x, xp, yp, logx=True, logy=True, **kwargs):
-    '''Interpolate in logspace (useful for SEDs)'''
+    With logx=False, x and xp are used as given, so precomputed logarithms
+    can be passed to avoid taking them again. If given, the result is written
+    to `out`.
+    '''
 
     if logx:
         x = np.log(x)
@@ -22,18 +60,23 @@ def interpolate_log(x, xp, yp, logx=True, logy=True, **kwargs):
         yp = log(yp)
     interp = np.interp(x, xp, yp, **kwargs)
     if logy:
-        interp = np.exp(interp)
+        return np.exp(interp, out=(interp if out is None else out))
+    if out is not None:
+        out[...] = interp
+        return out
     return interp
 
-def log(x):
+def log(x, out=None):
     '''Takes log, making invalid values a very small number'''
 
-    zeromask = x<=0
-    logx = np.empty(x.shape)
+    x = np.asarray(x)
+    if out is None:
+        out = np.empty(x.shape)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        np.log(x, out=out)
     # the largest negative value for which np.exp(x) returns zero
-    logx[zeromask] = -750.
-    logx[~zeromask] = np.log(x[~zeromask])
-    return logx
+    out[x <= 0] = -750.
+    return out
 
 def cache_simple_method(func):
     """Cache a method that takes no arguments to its return value"""
@@ -46,4 +89,29 @@ def cache_simple_method(func):
         if key not in self._cache:
             self._cache[key] = func(self)
         return self._cache[key]
-    return execute_method
\ No newline at end of file
+    return execute_method
+
+def grid_key(grid):
+    """Hashable key that identifies a grid by its values"""
+
+    grid = np.ascontiguousarray(grid)
+    return (grid.shape, grid.dtype.str, hashlib.sha1(grid).digest())
+
+class LRUCache(OrderedDict):
+    """Dictionary that holds at most `maxsize` items, dropping the least
+    recently used item first"""
+
+    def __init__(self, maxsize=32):
+        super().__init__()
+        self.maxsize = maxsize
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        self.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        if len(self) > self.maxsize:
+            del self[next(iter(self))]
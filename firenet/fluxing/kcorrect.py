@@ -0,0 +1,146 @@
+"""
+K-corrections of whole catalogues of galaxies.
+
+The K-correction of a band is linear in the scale of the model SED, so the
+corrected flux is the observed flux times the ratio of the restframe and
+observed-frame model fluxes, K(z) = F_model,rest(z) / F_model,obs. These
+ratios only depend on the model SED, the filters and the redshift, and are
+cached per model SED (on a redshift grid that is the same for every
+catalogue).
+"""
+import numpy as np
+import pandas as pd
+from .filters import get_filter
+from .filters.helpers import grid_key, LRUCache
+
+# (model SED, filters) -> {z key: K(z) for each filter}
+_KCORRECTION_CACHE = LRUCache(maxsize=64)
+# Redshifts per model SED in the cache
+_MAX_REDSHIFTS = 4096
+
+def k_correction_factors(model_sed, filters, redshifts, z_step=1e-3, approximate=True):
+    """
+    K-correction factors of a model SED: the corrected fluxes are the
+    observed fluxes times these factors.
+
+    Parameters
+    ----------
+    model_sed : HighresSED
+        The model SED, in the observed frame (its normalisation does not
+        matter).
+    filters : iterable
+        `Filter`s or filter names.
+    redshifts : array, shape (n_galaxies,)
+        Non-finite (e.g. missing) redshifts get nan factors.
+    z_step : float or None, default 1e-3
+        If there are more unique redshifts than points on a grid with this
+        step (the multiples of `z_step`), K(z) is computed on the grid and
+        linearly interpolated (about 1e-5 relative error for the default
+        step). If None, or if there are few unique redshifts, K(z) is
+        computed at every unique redshift.
+    approximate : bool, default True
+        Use the `FilterSetConvolver` (see `HighresSED.to_broadband`). If
+        False, convolve with each filter exactly.
+
+    Returns
+    -------
+    factors : array, shape (n_galaxies, n_filters)
+    """
+
+    filters = tuple(get_filter(filt) for filt in filters)
+    key = (grid_key(model_sed.wavelengths), grid_key(model_sed.fnu), filters,
+           approximate)
+    if key not in _KCORRECTION_CACHE:
+        _KCORRECTION_CACHE[key] = LRUCache(maxsize=_MAX_REDSHIFTS)
+    d_factors = _KCORRECTION_CACHE[key]
+    redshifts = np.asarray(redshifts, dtype=np.float64)
+    factors = np.full((len(redshifts), len(filters)), np.nan)
+    finite = np.isfinite(redshifts)
+    if not np.any(finite):
+        return factors
+    redshifts = redshifts[finite]
+    unique_z, inverse = np.unique(redshifts, return_inverse=True)
+    z_grid = unique_z
+    # Cache keys: the unique redshifts, or the grid point numbers
+    z_keys = [(None, z) for z in unique_z]
+    if z_step is not None:
+        k_grid = np.arange(np.floor(unique_z[0] / z_step),
+                           np.ceil(unique_z[-1] / z_step) + 1).astype(int)
+        if len(k_grid) < len(unique_z):
+            z_grid = k_grid * z_step
+            z_keys = [(z_step, k) for k in k_grid]
+    model_broad = None
+    li_factors = []
+    for z, z_key in zip(z_grid, z_keys):
+        if z_key not in d_factors:
+            if model_broad is None:
+                model_broad = model_sed.to_broadband(filters, approximate=approximate).fnu
+            # Lazy blueshift: shares the arrays of the model SED, and keeps the
+            # shifted grid and its convolver in the model's shift cache
+            model_rest = model_sed.blueshifted(z)
+            d_factors[z_key] = (model_rest.to_broadband(filters, approximate=approximate).fnu
+                                / model_broad)
+        li_factors.append(d_factors[z_key])
+    grid_factors = np.vstack(li_factors)
+    if z_grid is unique_z:
+        factors[finite] = grid_factors[inverse]
+    else:
+        factors[finite] = np.column_stack([np.interp(redshifts, z_grid, grid_factors[:, i])
+                                           for i in range(len(filters))])
+    return factors
+
+def k_correct_batch(fluxes, redshifts, model_seds, z_step=1e-3, approximate=True):
+    """
+    K-correct a catalogue of broadband fluxes.
+
+    Parameters
+    ----------
+    fluxes : pd.DataFrame
+        Galaxies x bands, the columns are filter names.
+    redshifts : pd.Series or array
+        If a Series, it is indexed by galaxy (as `fluxes`). Otherwise, it
+        matches the rows of `fluxes`.
+    model_seds : HighresSED, or sequence or pd.Series of HighresSEDs
+        A single model SED for all galaxies, or one model per galaxy (a
+        Series is indexed by galaxy). Galaxies sharing a model share its
+        K(z) computation.
+    z_step : float or None, default 1e-3
+        See `k_correction_factors`.
+    approximate : bool, default True
+        See `k_correction_factors`.
+
+    Returns
+    -------
+    fluxes_kcorr : pd.DataFrame
+        The K-corrected fluxes, with the same index and columns as `fluxes`.
+    """
+
+    if isinstance(redshifts, pd.Series):
+        redshifts = redshifts.loc[fluxes.index]
+    redshifts = np.asarray(redshifts, dtype=np.float64)
+    if len(redshifts) != len(fluxes):
+        raise ValueError('There should be one redshift per galaxy')
+    if 'HighresSED' in str(type(model_seds)):
+        li_models = [model_seds]
+        model_idx = np.zeros(len(fluxes), dtype=int)
+    else:
+        if isinstance(model_seds, pd.Series):
+            model_seds = model_seds.loc[fluxes.index]
+        if len(model_seds) != len(fluxes):
+            raise ValueError('There should be one model SED per galaxy')
+        # Group the galaxies by model SED
+        d_model_idx = {}
+        li_models = []
+        model_idx = np.empty(len(fluxes), dtype=int)
+        for i, model_sed in enumerate(model_seds):
+            if id(model_sed) not in d_model_idx:
+                d_model_idx[id(model_sed)] = len(li_models)
+                li_models.append(model_sed)
+            model_idx[i] = d_model_idx[id(model_sed)]
+    factors = np.empty(fluxes.shape)
+    for i, model_sed in enumerate(li_models):
+        rows = np.flatnonzero(model_idx == i)
+        factors[rows] = k_correction_factors(model_sed, fluxes.columns,
+                                             redshifts[rows], z_step=z_step,
+                                             approximate=approximate)
+    return fluxes * factors
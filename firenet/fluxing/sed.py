@@ -1,4 +1,6 @@
-from .filters import Filter
+from .filters import FilterSetConvolver, get_filter
+from .filters.helpers import LRUCache
+from .kcorrect import k_correction_factors
 
 import numpy as np
 from astropy.io import fits
@@ -43,11 +45,47 @@ class HighresSED(SED):
     """
     Represents an SED that is sampled at high spectral resolution, probably
     originating from a library of models.
+
+    Redshifting and blueshifting are lazy: the shift is stored, and only
+    applied when `wavelengths` or `fnu` are read (the SED then holds the
+    shifted arrays, as after an eager shift). `to_broadband` does not need
+    to apply it: it uses shifted arrays and convolvers that are kept in a
+    small LRU per SED, which is shared with the views from `redshifted` and
+    `blueshifted`.
+
+    The views share the unshifted arrays. Assigning `wavelengths` or `fnu`
+    (also `sed.fnu *= x`) drops the cached shifted arrays of the SED and its
+    views; editing elements in place (`sed.fnu[0] = x`) does not.
     """
 
     def __init__(self, wavelengths, fnu, ferr=None):
+        # Factors (multiply, divide) applied to the wavelengths and fnu
+        self._shift = (1., 1.)
+        self._shift_cache = LRUCache(maxsize=16)
         super().__init__(wavelengths, fnu, ferr)
 
+    @property
+    def wavelengths(self):
+        self._materialise()
+        return self._wavelengths
+
+    @wavelengths.setter
+    def wavelengths(self, wavelengths):
+        self._materialise()
+        self._wavelengths = wavelengths
+        self._reset_cache()
+
+    @property
+    def fnu(self):
+        self._materialise()
+        return self._fnu
+
+    @fnu.setter
+    def fnu(self, fnu):
+        self._materialise()
+        self._fnu = fnu
+        self._reset_cache()
+
     @classmethod
     def from_cigale_fits(cls, filename, flux_column='Fnu', fluxfactor=1, 
                          hdu_index=1, combine_column_list=True):
@@ -66,26 +104,30 @@ class HighresSED(SED):
             If False, return an equally large list of HighresSEDs.
         '''
 
-        hdu = fits.open(filename)[hdu_index]
-        wavelengths = hdu.data['wavelength'] / 1e3  # from nm to micron
-
-        def get_fnu(fluxcol):
-            fnu = hdu.data[fluxcol] * fluxfactor
-            if fluxcol == 'Fnu':
-                fnu /= 1e3  # From mJy to Jy
-            else:  # from W/nm to per W/Hz
-                fnu = np.square(wavelengths) * fnu / (c * 1e3)
-            return fnu
-
-        if isinstance(flux_column, (list, tuple)):
-            if not combine_column_list:
-                return [cls(wavelengths, get_fnu(fluxcol)) for fluxcol in flux_column]
-            fnu = sum([get_fnu(fluxcol) for fluxcol in flux_column])
-        else:
-            fnu = get_fnu(flux_column)
+        # Memory-map the file, so only the used columns are read, and close
+        # it as soon as they are converted.
+        with fits.open(filename, memmap=True) as hdulist:
+            data = hdulist[hdu_index].data
+            wavelengths = data['wavelength'] / 1e3  # from nm to micron
+
+            def get_fnu(fluxcol):
+                fnu = data[fluxcol] * fluxfactor
+                if fluxcol == 'Fnu':
+                    fnu /= 1e3  # From mJy to Jy
+                else:  # from W/nm to per W/Hz
+                    fnu = np.square(wavelengths) * fnu / (c * 1e3)
+                return fnu
+
+            if isinstance(flux_column, (list, tuple)):
+                if not combine_column_list:
+                    return [cls(wavelengths, get_fnu(fluxcol))
+                            for fluxcol in flux_column]
+                fnu = sum([get_fnu(fluxcol) for fluxcol in flux_column])
+            else:
+                fnu = get_fnu(flux_column)
         return cls(wavelengths, fnu)
 
-    def to_broadband(self, filters, quick=False):
+    def to_broadband(self, filters, quick=False, approximate=False):
         '''
         Transforms the full SED to broadband (returns new BroadbandSED).
 
@@ -94,30 +136,74 @@ class HighresSED(SED):
 
         filters : iterable
             The elements should be either of class `Filter`, or strings from
-            which a filter can be created. When calling this function multiple
-            times, create the `Filter`s beforehand so you can reuse them.
-            If using strings, the `Filter`s will be loaded from disk which is
-            slow.
+            which a filter can be created. Strings are resolved through the
+            process-wide `FilterBank`, so each filter is only read from disk
+            once.
 
         quick : bool, default False
             If True, take the flux closest to the filters pivot wavelength,
             instead of doing the convolution.
+
+        approximate : bool, default False
+            If False, convolve with each `Filter` separately (log-log
+            interpolation of the SED). If True, apply all filters as one
+            matrix product with a cached `FilterSetConvolver`, which is much
+            faster and agrees within its documented tolerance.
         '''
 
-        ffilters = []  # make sure to copy
-        fnu_bands = []
-        for filt in filters:
-            if not isinstance(filt, Filter):
-                filt = Filter(filt)
-            ffilters.append(filt)
-            if quick:
-                best_idx = np.searchsorted(self.wavelengths, filt.pivot_wavelength())
-                fnu = self.fnu[best_idx]
-            else:
-                fnu = filt.convolve(self.wavelengths, self.fnu)
-            fnu_bands.append(fnu)
+        ffilters = [get_filter(filt) for filt in filters]  # make sure to copy
+        # The (cached) shifted arrays, without applying the shift to the SED
+        shifted = self._get_shifted()
+        wavelengths, fnu = shifted['wavelengths'], shifted['fnu']
+        if quick:
+            fnu_bands = []
+            for filt in ffilters:
+                best_idx = np.searchsorted(wavelengths, filt.pivot_wavelength())
+                fnu_bands.append(fnu[best_idx])
+        elif approximate:
+            fnu_bands = self._get_convolver(ffilters).convolve(fnu)
+        else:
+            fnu_bands = [filt.convolve(wavelengths, fnu) for filt in ffilters]
         return BroadbandSED(ffilters, fnu_bands)
 
+    @staticmethod
+    def to_broadband_array(seds, filters, wavelengths=None):
+        '''
+        Convolve many SEDs that share one wavelength grid in a single
+        vectorised pass.
+
+        Parameters
+        ----------
+
+        seds : list of HighresSED, or array of shape (n_seds, n_wavelengths)
+            The SEDs, e.g. from `from_cigale_fits(..., combine_column_list=False)`
+            or a model library. If an array of Fnu, `wavelengths` is required.
+
+        filters : iterable
+            `Filter`s or filter names.
+
+        wavelengths : array or None, default None
+            The shared wavelength grid (micron), only used for an array of Fnu.
+
+        Returns
+        -------
+
+        fnu_bands : array, shape (n_seds, n_filters)
+        '''
+
+        if isinstance(seds, np.ndarray):
+            if wavelengths is None:
+                raise ValueError('wavelengths are required for an array of SEDs')
+            fnu = seds
+        else:
+            wavelengths = seds[0].wavelengths
+            for sed in seds[1:]:
+                if not np.array_equal(sed.wavelengths, wavelengths):
+                    raise ValueError('All SEDs should share one wavelength grid')
+            fnu = np.vstack([sed.fnu for sed in seds])
+        convolver = FilterSetConvolver.get(wavelengths, filters)
+        return convolver.convolve(np.atleast_2d(fnu))
+
     def blueshift(self, z):
         '''
         Blueshift the spectrum (to bring it to restframe), by shifting
@@ -126,14 +212,85 @@ class HighresSED(SED):
 
         # Divide by (1+z) becaues fnu (F_nu dnu = F_lambda dlambda stays
         # constant when redshifting). See Hogg 2002 and Hogg 2000 on K-correction.
-        self.fnu = self.fnu / (1 + z)
-        self.wavelengths = self.wavelengths / (1+z)
+        mult, div = self._shift
+        self._shift = (mult, div * (1 + z))
 
     def redshift(self, z):
         '''Redshift the model spectrum, by shifting all wavelengths.'''
 
-        self.fnu = self.fnu * (1 + z)
-        self.wavelengths = self.wavelengths * (1 + z)
+        mult, div = self._shift
+        self._shift = (mult * (1 + z), div)
+
+    def blueshifted(self, z):
+        '''Blueshifted view of the SED (see blueshift), without copying.'''
+
+        new = self._view()
+        new.blueshift(z)
+        return new
+
+    def redshifted(self, z):
+        '''Redshifted view of the SED (see redshift), without copying.'''
+
+        new = self._view()
+        new.redshift(z)
+        return new
+
+    def _view(self):
+        '''New SED sharing the (unshifted) arrays and the shift cache'''
+
+        new = type(self).__new__(type(self))
+        new.__dict__.update(self.__dict__)
+        return new
+
+    def _get_shifted(self):
+        '''The arrays for the current shift, from the cache when possible'''
+
+        if self._shift not in self._shift_cache:
+            if self._shift == (1., 1.):
+                wavelengths, fnu = self._wavelengths, self._fnu
+            else:
+                mult, div = self._shift
+                wavelengths = self._wavelengths * mult / div
+                fnu = self._fnu * mult / div
+                wavelengths.flags.writeable = False
+                fnu.flags.writeable = False
+            self._shift_cache[self._shift] = {'wavelengths': wavelengths,
+                                              'fnu': fnu, 'convolvers': {}}
+        return self._shift_cache[self._shift]
+
+    def _materialise(self):
+        '''Apply the shift to the stored arrays'''
+
+        if self._shift != (1., 1.):
+            shifted = self._get_shifted()
+            self._wavelengths = shifted['wavelengths'].copy()
+            self._fnu = shifted['fnu'].copy()
+            self._shift = (1., 1.)
+            # The shared cache belongs to the unshifted arrays
+            self._shift_cache = LRUCache(maxsize=16)
+
+    def _reset_cache(self):
+        '''Drop the cached arrays (also for the views) after an assignment'''
+
+        # The views may share arrays that were edited in place
+        self._shift_cache.clear()
+        self._shift_cache = LRUCache(maxsize=16)
+
+    def _get_convolver(self, filters):
+        '''FilterSetConvolver for the current (shifted) grid'''
+
+        shifted = self._get_shifted()
+        convolvers = shifted['convolvers']
+        filters = tuple(filters)
+        if filters not in convolvers:
+            if self._shift == (1., 1.):
+                # Shared between SEDs on the same grid
+                convolvers[filters] = FilterSetConvolver.get(shifted['wavelengths'],
+                                                             filters)
+            else:
+                convolvers[filters] = FilterSetConvolver(shifted['wavelengths'],
+                                                         filters)
+        return convolvers[filters]
 
 class BroadbandSED(SED):
     """
@@ -144,8 +301,7 @@ class BroadbandSED(SED):
         wavelengths = []
         filter_objs = []  # create new copy so we can modify list
         for filt in filters:
-            if not isinstance(filt, Filter):
-                filt = Filter(filt)
+            filt = get_filter(filt)
             filter_objs.append(filt)
             wavelengths.append(filt.pivot_wavelength())
         super().__init__(wavelengths, fnu, ferr)
@@ -164,15 +320,12 @@ class BroadbandSED(SED):
         if not 'HighresSED' in str(type(modelSED)):
             raise ValueError('modelSED must be a HighresSED, was', type(modelSED))
 
-        model_broad = modelSED.to_broadband(self.filters)
-        fnu_kcorr = []
-        for i, filt in enumerate(self.filters):
-            scalef = self.fnu[i] / model_broad.fnu[i]
-            model_f = modelSED * scalef
-            model_f.blueshift(z)
-            fnu_band = filt.convolve(model_f.wavelengths, model_f.fnu)
-            fnu_kcorr.append(fnu_band)
-        return BroadbandSED(self.filters, fnu_kcorr)
+        # The correction is linear in the scale of the model, so instead of
+        # scaling the model for each band, use the ratio of restframe to
+        # observed-frame model fluxes.
+        factors = k_correction_factors(modelSED, self.filters, [z], z_step=None,
+                                       approximate=False)
+        return BroadbandSED(self.filters, self.fnu * factors[0])
 
     def copy(self):
         """Returns a copy"""
@@ -0,0 +1,174 @@
+"""
+Compact container for `d_data`, the per-simulation galaxy fluxes.
+"""
+from collections.abc import Mapping
+import numpy as np
+import pandas as pd
+
+class GalaxyTable(Mapping):
+    """
+    Galaxy fluxes of several simulations ('fullbay', 'shortbay', 'observed',
+    ...), stored as one contiguous (n_galaxies, n_bands) array per
+    simulation, sharing a single galaxy index.
+
+    It can be used wherever the old dict of DataFrames is used:
+    `table['fullbay']` is a DataFrame (wrapping the block, without copying)
+    and assigning a DataFrame adds a block. 1-dimensional data (e.g.
+    'redshift') is kept as a separate array and returned as a Series.
+    `select` gives the raw array of a set of bands, which is a view if the
+    bands are contiguous in the block.
+
+    Parameters
+    ----------
+    index : pd.Index or array
+        The galaxy ids, shared by all blocks.
+    dtype : numpy dtype, default np.float64
+        The dtype of the blocks.
+    """
+
+    def __init__(self, index, dtype=np.float64):
+        self.index = pd.Index(index)
+        if not self.index.is_unique:
+            raise ValueError('The galaxy index should be unique')
+        self.dtype = np.dtype(dtype)
+        self._d_blocks = {}  # name -> 2D array
+        self._d_columns = {}  # name -> pd.Index of band names
+        self._d_offsets = {}  # name -> {band: column offset}
+        self._d_series = {}  # name -> 1D array
+
+    @classmethod
+    def from_dict(cls, d_data, index=None, dtype=np.float64):
+        """
+        Convert a dict of DataFrames/Series. Each entry is aligned on `index`
+        (missing galaxies become nan). If `index` is None, use the index of
+        'fullbay' (or of the first entry).
+        """
+
+        if isinstance(d_data, GalaxyTable):
+            return d_data
+        if index is None:
+            first = d_data['fullbay'] if 'fullbay' in d_data else next(iter(d_data.values()))
+            index = first.index
+        table = cls(index, dtype=dtype)
+        for name, data in d_data.items():
+            table[name] = data
+        return table
+
+    def copy(self):
+        """Shallow copy: adding or replacing entries does not change this table"""
+
+        table = type(self)(self.index, dtype=self.dtype)
+        for attr in ['_d_blocks', '_d_columns', '_d_offsets', '_d_series']:
+            setattr(table, attr, dict(getattr(self, attr)))
+        return table
+
+    def to_dict(self):
+        """Convert to a dict of DataFrames/Series (copies)"""
+
+        return {name: self[name].copy() for name in self}
+
+    def __getitem__(self, name):
+        if name in self._d_series:
+            return pd.Series(self._d_series[name], index=self.index, name=name)
+        if name not in self._d_blocks:
+            raise KeyError(name)
+        return pd.DataFrame(self._d_blocks[name], index=self.index,
+                            columns=self._d_columns[name], copy=False)
+
+    def __setitem__(self, name, data):
+        if isinstance(data, (pd.Series, pd.DataFrame)):
+            if not data.index.equals(self.index):
+                data = data.reindex(self.index)
+        elif len(data) != len(self.index):
+            raise ValueError(f'{name} has {len(data)} rows, expected '
+                             f'{len(self.index)}')
+        self._d_blocks.pop(name, None)
+        self._d_series.pop(name, None)
+        if isinstance(data, pd.DataFrame):
+            columns = data.columns
+            values = data.values
+        else:
+            values = np.asarray(data)
+            if values.ndim == 1:
+                self._d_series[name] = np.array(values, dtype=self.dtype)
+                return
+            columns = pd.RangeIndex(values.shape[1])
+        self._d_blocks[name] = np.ascontiguousarray(values, dtype=self.dtype)
+        self._d_columns[name] = pd.Index(columns)
+        self._d_offsets[name] = {band: i for i, band in enumerate(columns)}
+
+    def __delitem__(self, name):
+        if name in self._d_series:
+            del self._d_series[name]
+        else:
+            del self._d_blocks[name]
+            del self._d_columns[name]
+            del self._d_offsets[name]
+
+    def __iter__(self):
+        yield from self._d_blocks
+        yield from self._d_series
+
+    def __len__(self):
+        return len(self._d_blocks) + len(self._d_series)
+
+    def __repr__(self):
+        shapes = ', '.join(f'{name}: {self.block(name).shape}' for name in self)
+        return f'GalaxyTable({len(self.index)} galaxies; {shapes})'
+
+    def block(self, name):
+        """The array of a simulation (no copy)"""
+
+        if name in self._d_series:
+            return self._d_series[name]
+        return self._d_blocks[name]
+
+    def columns(self, name):
+        """The band names of a simulation"""
+
+        return self._d_columns[name]
+
+    def offsets(self, name, bands):
+        """Column offsets of `bands` in the block of a simulation"""
+
+        d_offsets = self._d_offsets[name]
+        missing = [band for band in bands if band not in d_offsets]
+        if len(missing) > 0:
+            raise KeyError(f'Bands {missing} not in {name}')
+        return np.array([d_offsets[band] for band in bands], dtype=np.intp)
+
+    def select(self, name, bands=None, rows=None):
+        """
+        Array of some bands (and galaxies) of a simulation.
+
+        Parameters
+        ----------
+        name : string
+            The simulation, e.g. 'shortbay'.
+        bands : list or None, default None
+            If None, all bands. A view of the block is returned if the bands
+            are contiguous (in order), otherwise a copy.
+        rows : slice, array or None, default None
+            Positional galaxy selection.
+        """
+
+        block = self._d_blocks[name]
+        cols = slice(None) if bands is None else self._column_slice(name, bands)
+        if rows is None:
+            return block[:, cols]
+        if isinstance(rows, slice):
+            return block[rows, cols]
+        return block[rows][:, cols]
+
+    def select_frame(self, name, bands=None):
+        """DataFrame of some bands of a simulation (see `select`)"""
+
+        columns = self._d_columns[name] if bands is None else pd.Index(bands)
+        return pd.DataFrame(self.select(name, bands), index=self.index,
+                            columns=columns, copy=False)
+
+    def _column_slice(self, name, bands):
+        offsets = self.offsets(name, bands)
+        if len(offsets) > 0 and np.all(np.diff(offsets) == 1):
+            return slice(offsets[0], offsets[-1] + 1)
+        return offsets
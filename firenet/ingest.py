@@ -0,0 +1,284 @@
+"""
+Ingestion of the CIGALE input (.mag) and output (results.txt) tables into
+`d_data`, the dictionary of DataFrames used by the notebooks and predictors
+(see notebook 01).
+
+Parsing the space-separated tables is the slow part, so the needed columns
+of every table are cached as uncompressed .npz files in `<datadir>/cache`.
+A cache entry is keyed by the source file, and is reused as long as the
+source has the same modification time and size, or the same sha1 hash. The
+flux to luminosity factors (see `units.LuminosityConverter`) are cached per
+redshift table and cosmology.
+"""
+import hashlib
+import pickle
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from .units import default_converter, redshift_fingerprint
+
+# From CIGALE broadband name to our standard broadband names
+COLMAP = {'FUV': 'GALEX_FUV', 'NUV': 'GALEX_NUV', 'u_prime': 'SDSS_u',
+          'g_prime': 'SDSS_g', 'r_prime': 'SDSS_r', 'i_prime': 'SDSS_i',
+          'z_prime': 'SDSS_z', 'J_2mass': '2MASS_J', 'H_2mass': '2MASS_H',
+          'Ks_2mass': '2MASS_Ks', 'WISE1': 'WISE_3.4', 'WISE2': 'WISE_4.6',
+          'WISE3': 'WISE_12', 'WISE4': 'WISE_22', 'PACS_blue': 'PACS_70',
+          'PACS_green': 'PACS_100', 'PACS_red': 'PACS_160',
+          'PSW_HIPE': 'SPIRE_250', 'PMW_HIPE': 'SPIRE_350',
+          'PLW_HIPE': 'SPIRE_500'}
+# Output (Bayesian) fluxes and uncertainties
+FLUXMAP = {'bayes.'+k: v for k, v in COLMAP.items()}
+ERRMAP = {'bayes.'+k+'_err': v for k, v in COLMAP.items()}
+# Input fluxes and uncertainties
+FLUXERRMAP = {k+'_err': v for k, v in COLMAP.items()}
+
+DATASETS = ('dustpedia', 'hatlas')
+CACHE_VERSION = 1
+
+def file_hash(filename, blocksize=1 << 20):
+    """sha1 hex digest of a file's contents"""
+
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+class TableCache:
+    """
+    Columnar cache of (parts of) CIGALE tables.
+
+    Parameters
+    ----------
+    cachedir : path
+        Directory of the cache files, created when needed.
+    """
+
+    def __init__(self, cachedir):
+        self.cachedir = Path(cachedir)
+
+    def read_table(self, filename, columns):
+        """
+        Read some columns of a space-separated CIGALE table, indexed by its
+        first column (the galaxy id). Missing values (consecutive spaces)
+        become nan.
+
+        Parameters
+        ----------
+        filename : path
+        columns : list of strings
+            The columns to read.
+
+        Returns
+        -------
+        df : pd.DataFrame
+            The columns, in the order of `columns`.
+        """
+
+        filename = Path(filename)
+        columns = list(columns)
+        cachefile = self._get_cachefile(filename, columns)
+        stat = filename.stat()
+        if cachefile.exists():
+            with np.load(cachefile, allow_pickle=False) as npz:
+                meta = npz['meta']
+                valid = (int(meta[0]) == CACHE_VERSION and
+                         float(meta[1]) == stat.st_mtime and
+                         int(meta[2]) == stat.st_size)
+                if not valid and int(meta[0]) == CACHE_VERSION:
+                    # Touched or copied, but maybe unchanged
+                    valid = str(npz['sha1']) == file_hash(filename)
+                    if valid:
+                        self._write(cachefile, stat, npz['index'], npz['values'],
+                                    str(npz['sha1']), str(npz['index_name']))
+                if valid:
+                    index_name = str(npz['index_name']) or None
+                    return pd.DataFrame(npz['values'], columns=columns,
+                                        index=pd.Index(npz['index'], name=index_name))
+        df = self._parse(filename, columns)
+        self._write(cachefile, stat, df.index.values, df.values,
+                    file_hash(filename), df.index.name)
+        return df
+
+    def read_array(self, name):
+        """Read a cached array (see `write_array`), or None if not cached"""
+
+        cachefile = self.cachedir / f'{name}.npy'
+        if not cachefile.exists():
+            return None
+        return np.load(cachefile, allow_pickle=False)
+
+    def write_array(self, name, array):
+        """Cache an array under a name"""
+
+        self.cachedir.mkdir(parents=True, exist_ok=True)
+        np.save(self.cachedir / f'{name}.npy', array, allow_pickle=False)
+
+    @staticmethod
+    def _parse(filename, columns):
+        header = pd.read_csv(filename, sep=' ', nrows=0).columns
+        missing = [col for col in columns if col not in header]
+        if len(missing) > 0:
+            raise ValueError(f'Columns {missing} not in {filename}')
+        df = pd.read_csv(filename, sep=' ', index_col=0,
+                         usecols=[header[0]] + columns)
+        return df[columns].astype(np.float64)
+
+    def _get_cachefile(self, filename, columns):
+        key = hashlib.sha1('\n'.join([str(filename.resolve())] + columns)
+                           .encode()).hexdigest()[:16]
+        return self.cachedir / f'{filename.stem}_{key}.npz'
+
+    def _write(self, cachefile, stat, index, values, sha1, index_name):
+        self.cachedir.mkdir(parents=True, exist_ok=True)
+        index = np.asarray(index)
+        if index.dtype == object:
+            index = index.astype(str)
+        meta = np.array([CACHE_VERSION, stat.st_mtime, stat.st_size],
+                        dtype=np.float64)
+        # Write to a temporary file first, so a crash leaves no broken entry
+        tmpfile = cachefile.with_name(cachefile.name + '.tmp')
+        with tmpfile.open('wb') as outf:
+            np.savez(outf, meta=meta, sha1=np.array(sha1), index=index,
+                     index_name=np.array(index_name or ''),
+                     values=np.asarray(values, dtype=np.float64))
+        tmpfile.replace(cachefile)
+
+class CigaleIngestor:
+    """
+    Builds `d_data` from the CIGALE data directory.
+
+    Parameters
+    ----------
+    datadir : path, default './data'
+        Directory with `redshift.pkl` and the `CIGALE` directory.
+    cachedir : path or None, default None
+        Directory of the columnar cache. If None, use `<datadir>/cache`.
+    use_cache : bool, default True
+        If False, always parse the tables (and do not write the cache).
+    converter : LuminosityConverter or None, default None
+        If None, use the Planck15 cosmology (`units.default_converter`).
+    """
+
+    def __init__(self, datadir='./data', cachedir=None, use_cache=True,
+                 converter=None):
+        self.datadir = Path(datadir)
+        self.converter = converter if converter is not None else default_converter
+        cachedir = cachedir if cachedir is not None else self.datadir / 'cache'
+        self.cache = TableCache(cachedir)
+        self.use_cache = use_cache
+        self._redshift = None
+        self._lumfactor = None
+
+    @property
+    def redshift(self):
+        """Redshift of every galaxy (pd.Series), from `redshift.pkl`"""
+
+        if self._redshift is None:
+            with open(self.datadir / 'redshift.pkl', 'rb') as infile:
+                self._redshift = pickle.load(infile)
+        return self._redshift
+
+    def luminosity_factor(self):
+        """
+        Factor from flux (mJy) to luminosity (W/Hz), without K-correction
+        (see e.g. Hogg 2000), for every galaxy in the redshift table:
+        4 pi D_L^2 / (1+z) (in SI units).
+        """
+
+        if self._lumfactor is not None:
+            return self._lumfactor
+        redshift = self.redshift
+        key = redshift_fingerprint(redshift) + repr(self.converter.cosmology)
+        name = 'lumfactor_' + hashlib.sha1(key.encode()).hexdigest()[:16]
+        factor = self.cache.read_array(name) if self.use_cache else None
+        if factor is None or len(factor) != len(redshift):
+            factor = self.converter.factor(redshift.values)
+            if self.use_cache:
+                self.cache.write_array(name, factor)
+        self._lumfactor = pd.Series(factor, index=redshift.index)
+        return self._lumfactor
+
+    def mjy_to_luminosity(self, dataframe):
+        """Flux (mJy) to luminosity (W/Hz)"""
+
+        factor = self.luminosity_factor().loc[dataframe.index].values
+        return pd.DataFrame(dataframe.values * factor[:, np.newaxis],
+                            index=dataframe.index, columns=dataframe.columns)
+
+    def read_table(self, filename, columns):
+        """Read columns of a CIGALE table, through the cache if enabled"""
+
+        if self.use_cache:
+            return self.cache.read_table(filename, columns)
+        return TableCache._parse(Path(filename), list(columns))
+
+    def read_output(self, dataset, simname):
+        """
+        Bayesian fluxes and uncertainties (W/Hz) of a CIGALE run, with our
+        standard band names.
+        """
+
+        filename = self.datadir / 'CIGALE' / dataset / simname / 'out' / 'results.txt'
+        df_raw = self.read_table(filename, list(FLUXMAP) + list(ERRMAP))
+        df_fluxbay = df_raw[list(FLUXMAP)].rename(columns=FLUXMAP)
+        df_fluxbayerr = df_raw[list(ERRMAP)].rename(columns=ERRMAP)
+        return self.mjy_to_luminosity(df_fluxbay), self.mjy_to_luminosity(df_fluxbayerr)
+
+    def read_input(self, dataset, simname):
+        """
+        Input fluxes and uncertainties (W/Hz) of a CIGALE run, with our
+        standard band names.
+        """
+
+        filename = (self.datadir / 'CIGALE' / dataset / simname /
+                    f'{dataset}_fluxes_{simname}.mag')
+        df_raw = self.read_table(filename, list(COLMAP) + list(FLUXERRMAP))
+        # remove fake entry (for short simulations)
+        if 'fake' in df_raw.index:
+            df_raw = df_raw.drop(labels=['fake'])
+        df_flux = df_raw[list(COLMAP)].rename(columns=COLMAP)
+        df_fluxerr = df_raw[list(FLUXERRMAP)].rename(columns=FLUXERRMAP)
+        return self.mjy_to_luminosity(df_flux), self.mjy_to_luminosity(df_fluxerr)
+
+    def build(self, datasets=DATASETS):
+        """
+        Build `d_data`, with the CIGALE output ('fullbay', 'fullbayerr',
+        'shortbay', 'shortbayerr'), the input ('observed', 'observederr') and
+        the 'redshift'.
+        """
+
+        d_data = {}
+        for simname in ['full', 'short']:
+            li_output = [self.read_output(dataset, simname) for dataset in datasets]
+            d_data[f'{simname}bay'] = pd.concat([lum for lum, _ in li_output], axis=0)
+            d_data[f'{simname}bayerr'] = pd.concat([err for _, err in li_output], axis=0)
+        d_data['redshift'] = self.redshift.loc[d_data['fullbay'].index]
+        # Only full is necessary (short is same but has nans)
+        li_input = [self.read_input(dataset, 'full') for dataset in datasets]
+        d_data['observed'] = pd.concat([lum for lum, _ in li_input], axis=0)
+        d_data['observederr'] = pd.concat([err for _, err in li_input], axis=0)
+        return d_data
+
+def load_d_data(datadir='./data', datasets=DATASETS, cachedir=None,
+                use_cache=True, outfile=None):
+    """
+    Build `d_data` from the CIGALE tables (see `CigaleIngestor`).
+
+    Parameters
+    ----------
+    datadir : path, default './data'
+    datasets : iterable of strings, default ('dustpedia', 'hatlas')
+    cachedir : path or None, default None
+    use_cache : bool, default True
+    outfile : path or None, default None
+        If given, also pickle `d_data` to this file (e.g.
+        './data/d_data.pkl', which `SinglePredictor` reads by default).
+    """
+
+    ingestor = CigaleIngestor(datadir, cachedir=cachedir, use_cache=use_cache)
+    d_data = ingestor.build(datasets)
+    if outfile is not None:
+        with open(outfile, 'wb') as outf:
+            pickle.dump(d_data, outf)
+    return d_data
@@ -1,6 +1,8 @@
 from .fullsetpredictor import *
+from .inference import *
 from .modelbuilder import *
 from .modelstore import *
 from .preprocessing import *
 from .reguncpredictor import *
+from .search import *
 from .singlepredictor import *
\ No newline at end of file
@@ -1,6 +1,7 @@
 import numpy as np
 import pandas as pd
 from sklearn.model_selection import KFold
+from .inference import EnsembleRegUncEngine
 from .reguncpredictor import RegUncPredictor
 
 class FullSetPredictor:
@@ -12,6 +13,7 @@ class FullSetPredictor:
     def __init__(self, d_data):
         self.d_data = d_data
         self.predictors = []
+        self._ensemble_engine = None
 
     def prepare_splits(self, n_splits=4, shuffle_state=123, idx_tot=None):
         """Prepare the train/test splits and models"""
@@ -30,14 +32,92 @@ class FullSetPredictor:
             pred.preprocess(idx_train, idx_test)
             self.predictors.append(pred)
         
-    def train(self, reg_kwargs=None, unc_kwargs=None):
-        """Train the predictors"""
+    def train(self, reg_kwargs=None, unc_kwargs=None, n_jobs=1, seed=None,
+              n_threads=None, checkpoint_dir='./models/checkpoints'):
+        """
+        Train the predictors.
+
+        Parameters
+        ----------
+        reg_kwargs, unc_kwargs : dict or None, default None
+            Keyword arguments for `RegUncPredictor.train_regressor` and
+            `train_uncertainty`.
+        n_jobs : int, default 1
+            Number of folds trained in parallel, each in its own process. The
+            trained predictors are sent back and rebuilt (as in
+            `ModelStore.load`, so without training history).
+        seed : int or None, default None
+            If given, seed torch with `seed + i` before training fold i, so
+            sequential and parallel runs give identical models (with the same
+            `n_threads`).
+        n_threads : int or None, default None
+            Torch threads per fold. If None, keep the torch default for
+            sequential runs, and divide the CPUs over the workers otherwise.
+        checkpoint_dir : path, default './models/checkpoints'
+            With `checkpoint='disk'` in the kwargs, each fold checkpoints to
+            `<checkpoint_dir>/fold<i>/{reg,unc}.pt` (unless `f_checkpoint` is
+            in the kwargs). By default, the best weights are kept in memory.
+        """
+
+        from .parallel import ordered_parallel_map, thread_limits
 
         reg_kwargs, unc_kwargs = self._set_default_kwargs(reg_kwargs, unc_kwargs)
-        for i, predictor in enumerate(self.predictors):
-            print(f'Start training model {i+1}/{len(self.predictors)}...')
-            predictor.train_regressor(**reg_kwargs)
-            predictor.train_uncertainty(**unc_kwargs)
+        self._ensemble_engine = None
+        trainer = _FoldTrainer(self.predictors, reg_kwargs, unc_kwargs, seed,
+                               checkpoint_dir)
+        n_folds = len(self.predictors)
+        if n_jobs == 1:
+            with thread_limits(n_threads):
+                for i in range(n_folds):
+                    print(f'Start training model {i+1}/{n_folds}...')
+                    trainer.train_fold(i)
+            return
+        from .modelstore import ModelStore
+        print(f'Training {n_folds} models in {n_jobs} processes...')
+        saveobjs = ordered_parallel_map(trainer, 'train_fold_saveobj', range(n_folds),
+                                        n_jobs, n_threads=n_threads,
+                                        max_in_flight=n_folds)
+        for i, saveobj in enumerate(saveobjs):
+            self.predictors[i] = ModelStore._load_reguncpredictor(saveobj, self.d_data)
+            print(f'Finished training model {i+1}/{n_folds}')
+
+    def get_engines(self, dtype=np.float32):
+        """Export the predictor of every fold as a `RegUncEngine`"""
+
+        return [predictor.get_engine(dtype=dtype) for predictor in self.predictors]
+
+    def predict_ensemble(self, X_reg, X_unc, chunksize=65536):
+        """
+        Predict with all folds at once (see `EnsembleRegUncEngine.predict`).
+
+        Parameters
+        ----------
+        X_reg, X_unc : pd.DataFrame or array
+            Log-normalised features of the regressor and the uncertainty
+            estimator (the same for every fold).
+        chunksize : int, default 65536
+
+        Returns
+        -------
+        Y_pred, Y_unc : pd.DataFrame (array if X_reg is an array)
+            Mean prediction and its uncertainty (stdev), including the
+            spread between the folds.
+        Y_pred_folds, Y_unc_folds : array, shape (n_folds, n_samples, n_targets)
+        """
+
+        engine = getattr(self, '_ensemble_engine', None)
+        if engine is None or engine.reg.n_networks != len(self.predictors):
+            engine = EnsembleRegUncEngine.from_engines(self.get_engines())
+            self._ensemble_engine = engine
+        is_df = isinstance(X_reg, pd.DataFrame)
+        results = engine.predict(X_reg.values if is_df else X_reg,
+                                 X_unc.values if is_df else X_unc,
+                                 chunksize=chunksize)
+        Y_pred, Y_unc, Y_pred_folds, Y_unc_folds = results
+        if is_df:
+            Y_pred = pd.DataFrame(Y_pred, index=X_reg.index, columns=engine.target_columns)
+            Y_unc = pd.DataFrame(Y_unc, index=X_reg.index, columns=engine.target_columns)
+        return Y_pred, Y_unc, Y_pred_folds, Y_unc_folds
 
     def get_combined_test(self):
         """Get combined y_t, y_p, y_err from all test sets"""
@@ -58,4 +138,36 @@ class FullSetPredictor:
 
         reg_kwargs.setdefault('verbose', False)
         unc_kwargs.setdefault('verbose', False)
-        return reg_kwargs, unc_kwargs
\ No newline at end of file
+        return reg_kwargs, unc_kwargs
+
+class _FoldTrainer:
+    """Trains the folds of a FullSetPredictor (in this or a worker process)"""
+
+    def __init__(self, predictors, reg_kwargs, unc_kwargs, seed, checkpoint_dir):
+        self.predictors = predictors
+        self.reg_kwargs = reg_kwargs
+        self.unc_kwargs = unc_kwargs
+        self.seed = seed
+        self.checkpoint_dir = checkpoint_dir
+
+    def train_fold(self, i):
+        import torch
+
+        if self.seed is not None:
+            torch.manual_seed(self.seed + i)
+        predictor = self.predictors[i]
+        for kwargs, train, suff in [(self.reg_kwargs, predictor.train_regressor, 'reg'),
+                                    (self.unc_kwargs, predictor.train_uncertainty, 'unc')]:
+            kwargs = dict(kwargs)
+            kwargs.setdefault('f_checkpoint', f'{self.checkpoint_dir}/fold{i}/{suff}.pt')
+            train(**kwargs)
+        return predictor
+
+    def train_fold_saveobj(self, i):
+        from .modelstore import ModelStore
+
+        predictor = self.train_fold(i)
+        # The uncertainty loss is a closure, which cannot be pickled, but
+        # _get_saveobj always stringifies it. The regressor loss (MSE) pickles.
+        saveobj, _ = ModelStore._get_saveobj(predictor, stringify_loss=False)
+        return saveobj
@@ -0,0 +1,413 @@
+"""
+Low-latency inference with trained predictors, without sklearn and skorch.
+
+The scalers of a trained pipeline are folded into the first and last linear
+layers, and the network is evaluated as a chain of numpy matmuls on float32
+arrays (preallocated per batch size).
+"""
+import numpy as np
+import pandas as pd
+from scipy.special import expit
+
+SELU_ALPHA = 1.6732632423543772
+SELU_SCALE = 1.0507009873554805
+
+def _relu(x, params):
+    return np.maximum(x, 0, out=x)
+
+def _sigmoid(x, params):
+    return expit(x, out=x)
+
+def _elu(x, params):
+    alpha = params.get('alpha', 1.)
+    neg = x < 0
+    x[neg] = alpha * np.expm1(x[neg])
+    return x
+
+def _selu(x, params):
+    neg = x < 0
+    x[neg] = SELU_ALPHA * np.expm1(x[neg])
+    x *= SELU_SCALE
+    return x
+
+def _softplus(x, params):
+    # As torch: linear above the threshold (in units of 1 / beta)
+    beta, threshold = params.get('beta', 1.), params.get('threshold', 20.)
+    small = x * beta <= threshold
+    x[small] = np.log1p(np.exp(beta * x[small])) / beta
+    return x
+
+# Activation (torch module class name) -> in-place numpy function
+NUMPY_ACTIVATIONS = {'ReLU': _relu, 'Sigmoid': _sigmoid, 'ELU': _elu, 'SELU': _selu,
+               'Softplus': _softplus}
+
+class MLPEngine:
+    """
+    A fully connected network, evaluated with numpy.
+
+    Parameters
+    ----------
+    weights : list of arrays, shapes (n_in, n_out)
+        The weights of each linear layer (transposed w.r.t. torch).
+    biases : list of arrays, shapes (n_out,)
+    activations : list of (string, dict) or None
+        For each linear layer, the activation after it (name in NUMPY_ACTIVATIONS
+        and its parameters), or None.
+    output_scale : array or None, default None
+        Factor applied to the output, after the last activation (e.g. the
+        correction factor of the uncertainty estimator).
+    dtype : numpy dtype, default np.float32
+    """
+
+    def __init__(self, weights, biases, activations, output_scale=None,
+                 dtype=np.float32):
+        if not (len(weights) == len(biases) == len(activations)):
+            raise ValueError('Each layer needs weights, biases and an activation')
+        self.dtype = np.dtype(dtype)
+        self.weights = [np.ascontiguousarray(w, dtype=self.dtype) for w in weights]
+        self.biases = [np.ascontiguousarray(b, dtype=self.dtype) for b in biases]
+        self.activations = list(activations)
+        self.output_scale = None
+        if output_scale is not None:
+            self.output_scale = np.ascontiguousarray(output_scale, dtype=self.dtype)
+        self._buffers = {}  # batch size -> layer outputs
+
+    @property
+    def n_inputs(self):
+        return self.weights[0].shape[0]
+
+    @property
+    def n_outputs(self):
+        return self.weights[-1].shape[1]
+
+    @classmethod
+    def from_model(cls, model, correction_factor=1, dtype=np.float32):
+        """
+        Export a trained model: a sklearn Pipeline of (optionally) a
+        StandardScaler and a skorch NeuralNetRegressor, the latter possibly
+        wrapped in a TransformedTargetRegressor with a StandardScaler.
+
+        Parameters
+        ----------
+        model : sklearn Pipeline or skorch NeuralNetRegressor
+        correction_factor : float or pd.Series, default 1
+            Multiplies the predictions (see `SinglePredictor.predict`).
+        dtype : numpy dtype, default np.float32
+        """
+
+        return cls.from_arrays(*cls._unpack_model(model), correction_factor,
+                               dtype=dtype)
+
+    @classmethod
+    def _unpack_model(cls, model):
+        """The layers and scalings of a model (see `from_model`)"""
+
+        from sklearn.compose import TransformedTargetRegressor
+        from sklearn.pipeline import Pipeline
+        from sklearn.preprocessing import StandardScaler
+
+        in_scaler, out_scaler = None, None
+        nnet = model
+        if isinstance(model, Pipeline):
+            steps = [step for _, step in model.steps]
+            if len(steps) == 2 and isinstance(steps[0], StandardScaler):
+                in_scaler = steps[0]
+            elif len(steps) != 1:
+                raise ValueError("Only pipelines of a StandardScaler and a network "
+                                 "can be exported", model)
+            nnet = steps[-1]
+        if isinstance(nnet, TransformedTargetRegressor):
+            if not isinstance(nnet.transformer_, StandardScaler):
+                raise ValueError("Only StandardScaler target transformers can be "
+                                 "exported", nnet.transformer_)
+            out_scaler = nnet.transformer_
+            nnet = nnet.regressor_
+        weights, biases, activations = cls._get_layers(nnet.module_)
+        in_scaling, out_scaling = None, None
+        if in_scaler is not None:
+            in_scaling = cls._get_scaling(in_scaler, weights[0].shape[0])
+        if out_scaler is not None:
+            out_scaling = cls._get_scaling(out_scaler, weights[-1].shape[1])
+        return weights, biases, activations, in_scaling, out_scaling
+
+    @classmethod
+    def from_arrays(cls, weights, biases, activations, in_scaling=None,
+                    out_scaling=None, correction_factor=1, dtype=np.float32):
+        """
+        Build the engine from the layers of a network and the (mean, scale) of
+        its input and target StandardScalers (or None), folding the scalers
+        and the correction factor into the linear layers.
+        """
+
+        weights = [np.asarray(w, dtype=np.float64) for w in weights]
+        biases = [np.asarray(b, dtype=np.float64) for b in biases]
+        if in_scaling is not None:
+            mean, scale = [np.asarray(a, dtype=np.float64) for a in in_scaling]
+            # W (x - mean) / scale + b
+            weights[0] = weights[0] / scale[:, np.newaxis]
+            biases[0] = biases[0] - mean @ weights[0]
+        output_scale = np.broadcast_to(np.asarray(correction_factor, dtype=np.float64),
+                                       (weights[-1].shape[1],))
+        if out_scaling is not None:
+            if activations[-1] is not None:
+                raise ValueError("A target scaler requires a linear output layer")
+            mean, scale = [np.asarray(a, dtype=np.float64) for a in out_scaling]
+            weights[-1] = weights[-1] * scale
+            biases[-1] = biases[-1] * scale + mean
+        if activations[-1] is None:
+            weights[-1] = weights[-1] * output_scale
+            biases[-1] = biases[-1] * output_scale
+            output_scale = None
+        elif np.all(output_scale == 1):
+            output_scale = None
+        return cls(weights, biases, activations, output_scale=output_scale,
+                   dtype=dtype)
+
+    @classmethod
+    def from_predictor(cls, predictor, dtype=np.float32):
+        """Export the model of a trained `SinglePredictor`"""
+
+        return cls.from_model(predictor.model, predictor.correction_factor,
+                              dtype=dtype)
+
+    def predict(self, X, out=None):
+        """
+        Predict on an array of shape (n_samples, n_inputs), or (n_inputs,) for
+        a single sample. If given, the (n_samples, n_outputs) result is
+        written into `out`.
+        """
+
+        X = np.asarray(X)
+        if X.ndim == 1:
+            return self.predict(X[np.newaxis])[0]
+        if X.shape[1] != self.n_inputs:
+            raise ValueError(f'X has {X.shape[1]} features, expected {self.n_inputs}')
+        buffers = self._get_buffers(len(X))
+        h = X
+        for i, (weight, bias, activation) in enumerate(
+                zip(self.weights, self.biases, self.activations)):
+            is_last = i == len(self.weights) - 1
+            layer_out = out if (is_last and out is not None) else buffers[i]
+            np.matmul(h, weight, out=layer_out)
+            layer_out += bias
+            if activation is not None:
+                name, params = activation
+                NUMPY_ACTIVATIONS[name](layer_out, params)
+            h = layer_out
+        if self.output_scale is not None:
+            h *= self.output_scale
+        if out is None:
+            # The last buffer is reused by the next call
+            h = h.copy()
+        return h
+
+    def _get_buffers(self, n_samples):
+        if n_samples not in self._buffers:
+            if len(self._buffers) >= 8:
+                self._buffers.clear()
+            self._buffers[n_samples] = [np.empty((n_samples, w.shape[1]), dtype=self.dtype)
+                                        for w in self.weights]
+        return self._buffers[n_samples]
+
+    @staticmethod
+    def _get_layers(module):
+        weights, biases, activations = [], [], []
+        # Not module.children(), which skips repeated (shared) activation modules
+        for layer in module:
+            layername = type(layer).__name__
+            if layername == 'Linear':
+                weights.append(layer.weight.detach().cpu().numpy().T.astype(np.float64))
+                bias = layer.bias
+                biases.append(np.zeros(layer.out_features) if bias is None else
+                              bias.detach().cpu().numpy().astype(np.float64))
+                activations.append(None)
+            elif layername in NUMPY_ACTIVATIONS:
+                if len(weights) == 0 or activations[-1] is not None:
+                    raise ValueError(f"Activation {layername} should follow a Linear layer")
+                params = {key: getattr(layer, key) for key in ['alpha', 'beta', 'threshold']
+                          if hasattr(layer, key)}
+                activations[-1] = (layername, params)
+            else:
+                raise ValueError(f"Cannot export layer {layername}")
+        return weights, biases, activations
+
+    @staticmethod
+    def _get_scaling(scaler, n_features):
+        mean = scaler.mean_ if scaler.mean_ is not None else np.zeros(n_features)
+        scale = scaler.scale_ if scaler.scale_ is not None else np.ones(n_features)
+        return np.asarray(mean, dtype=np.float64), np.asarray(scale, dtype=np.float64)
+
+class RegUncEngine:
+    """
+    Inference engine of a `RegUncPredictor`: the regressor and the uncertainty
+    estimator as `MLPEngine`s.
+
+    Parameters
+    ----------
+    reg, unc : MLPEngine
+    target_columns : list or None, default None
+        Names of the targets, to return DataFrames from `predict_df`.
+    """
+
+    def __init__(self, reg, unc, target_columns=None):
+        self.reg = reg
+        self.unc = unc
+        self.target_columns = target_columns
+
+    @classmethod
+    def from_predictor(cls, predictor, dtype=np.float32):
+        """Export a trained `RegUncPredictor`"""
+
+        return cls(MLPEngine.from_predictor(predictor.reg, dtype=dtype),
+                   MLPEngine.from_predictor(predictor.unc, dtype=dtype),
+                   target_columns=list(predictor.reg.Y.columns))
+
+    def predict(self, X_reg, X_unc):
+        """
+        Predict on log-normalised feature arrays (as `RegUncPredictor.predict`).
+        Returns the arrays Y_pred, Y_unc (stdev).
+        """
+
+        Y_pred = self.reg.predict(X_reg)
+        Y_unc = self.unc.predict(X_unc)
+        # In place: Z -> 1 / sqrt(Z)
+        np.sqrt(Y_unc, out=Y_unc)
+        np.reciprocal(Y_unc, out=Y_unc)
+        return Y_pred, Y_unc
+
+    def predict_df(self, X_reg, X_unc):
+        """`predict` on DataFrames, returning DataFrames"""
+
+        Y_pred, Y_unc = self.predict(X_reg.values, X_unc.values)
+        return (pd.DataFrame(Y_pred, index=X_reg.index, columns=self.target_columns),
+                pd.DataFrame(Y_unc, index=X_unc.index, columns=self.target_columns))
+
+class EnsembleEngine:
+    """
+    Several `MLPEngine`s with the same architecture (e.g. the folds of a
+    `FullSetPredictor`), evaluated together: the weights are stacked, so every
+    layer is a single batched matmul over all networks.
+
+    Parameters
+    ----------
+    engines : list of MLPEngine
+    """
+
+    def __init__(self, engines):
+        if len(engines) == 0:
+            raise ValueError('An ensemble needs at least one network')
+        first = engines[0]
+        for engine in engines[1:]:
+            if ([w.shape for w in engine.weights] != [w.shape for w in first.weights] or
+                    engine.activations != first.activations):
+                raise ValueError('All networks of an ensemble need the same architecture')
+        self.dtype = first.dtype
+        self.activations = first.activations
+        # Shapes (n_networks, n_in, n_out) and (n_networks, 1, n_out)
+        self.weights = [np.stack([engine.weights[i] for engine in engines]).astype(self.dtype)
+                        for i in range(len(first.weights))]
+        self.biases = [np.stack([engine.biases[i] for engine in engines])[:, np.newaxis]
+                       .astype(self.dtype) for i in range(len(first.biases))]
+        self.output_scale = None
+        if any(engine.output_scale is not None for engine in engines):
+            ones = np.ones(first.n_outputs, dtype=self.dtype)
+            self.output_scale = np.stack([
+                engine.output_scale if engine.output_scale is not None else ones
+                for engine in engines])[:, np.newaxis]
+
+    @property
+    def n_networks(self):
+        return len(self.weights[0])
+
+    @property
+    def n_outputs(self):
+        return self.weights[-1].shape[2]
+
+    def predict(self, X, out=None, chunksize=65536):
+        """
+        Predictions of every network, shape (n_networks, n_samples, n_outputs).
+
+        Parameters
+        ----------
+        X : array, shape (n_samples, n_inputs)
+        out : array or None, default None
+            Array to write the predictions into.
+        chunksize : int, default 65536
+            Number of samples per pass, which bounds the memory of the hidden
+            layers (n_networks x chunksize x layer size).
+        """
+
+        X = np.asarray(X)
+        if X.shape[1] != self.weights[0].shape[1]:
+            raise ValueError(f'X has {X.shape[1]} features, expected '
+                             f'{self.weights[0].shape[1]}')
+        if out is None:
+            out = np.empty((self.n_networks, len(X), self.n_outputs), dtype=self.dtype)
+        for start in range(0, len(X), chunksize):
+            stop = min(start + chunksize, len(X))
+            # The first layer broadcasts the shared inputs over the networks
+            h = X[start:stop].astype(self.dtype, copy=False)
+            for i, (weight, bias, activation) in enumerate(
+                    zip(self.weights, self.biases, self.activations)):
+                if i == len(self.weights) - 1:
+                    layer_out = out[:, start:stop]
+                else:
+                    layer_out = np.empty((self.n_networks, stop - start, weight.shape[2]),
+                                         dtype=self.dtype)
+                np.matmul(h, weight, out=layer_out)
+                layer_out += bias
+                if activation is not None:
+                    name, params = activation
+                    NUMPY_ACTIVATIONS[name](layer_out, params)
+                h = layer_out
+            if self.output_scale is not None:
+                h *= self.output_scale
+        return out
+
+class EnsembleRegUncEngine:
+    """
+    Inference engine of a `FullSetPredictor`: the regressors and the
+    uncertainty estimators of all folds, each as an `EnsembleEngine`.
+
+    Parameters
+    ----------
+    reg, unc : EnsembleEngine
+    target_columns : list or None, default None
+    """
+
+    def __init__(self, reg, unc, target_columns=None):
+        self.reg = reg
+        self.unc = unc
+        self.target_columns = target_columns
+
+    @classmethod
+    def from_engines(cls, engines):
+        """Combine the `RegUncEngine`s of the folds"""
+
+        return cls(EnsembleEngine([engine.reg for engine in engines]),
+                   EnsembleEngine([engine.unc for engine in engines]),
+                   target_columns=engines[0].target_columns)
+
+    def predict(self, X_reg, X_unc, chunksize=65536):
+        """
+        Predict with every fold on log-normalised feature arrays.
+
+        Returns
+        -------
+        Y_pred, Y_unc : array, shape (n_samples, n_targets)
+            The mean prediction of the folds, and its uncertainty (stdev):
+            the mean variance of the folds plus the variance between the
+            fold predictions.
+        Y_pred_folds, Y_unc_folds : array, shape (n_folds, n_samples, n_targets)
+            The prediction and uncertainty (stdev) of every fold.
+        """
+
+        Y_pred_folds = self.reg.predict(X_reg, chunksize=chunksize)
+        # Z = 1 / V
+        Z_folds = self.unc.predict(X_unc, chunksize=chunksize)
+        Y_pred = Y_pred_folds.mean(axis=0)
+        variance = np.reciprocal(Z_folds).mean(axis=0)
+        variance += Y_pred_folds.var(axis=0)
+        # In place: Z -> 1 / sqrt(Z)
+        Y_unc_folds = np.reciprocal(np.sqrt(Z_folds, out=Z_folds), out=Z_folds)
+        return Y_pred, np.sqrt(variance), Y_pred_folds, Y_unc_folds
@@ -2,6 +2,10 @@
 Helper functions to build (sklearn-compatible) predictors.
 """
 import os
+import threading
+import time
+import uuid
+import numpy as np
 import torch
 import skorch
 from sklearn.compose import TransformedTargetRegressor
@@ -47,7 +51,29 @@ def build_pytorch_nnet(arch, activation='relu', output_activation='linear',
             layers.append(ACTIVATIONS[output_activation])
     return torch.nn.Sequential(*layers)
 
+# 'minibatch': Adam on batches of 200 galaxies (the default)
+# 'fullbatch': Adam on the whole training set as one batch
+# 'lbfgs': LBFGS on the whole training set
+TRAINING_ENGINES = ['minibatch', 'fullbatch', 'lbfgs']
+
 def default_skorch_nnet(reg=True, insize=14, outsize=6, **kwargs):
+    """
+    The skorch regressor (reg) or uncertainty estimator (not reg). The kwargs
+    are those of NeuralNetRegressor, and `hidden_layer_sizes`, `activation`,
+    `outact`, `lr_policy`, `lr_policy_kwargs`, `batch_iterator` ('dataloader'
+    or 'tensor') and `engine` (see TRAINING_ENGINES), which sets the defaults
+    of the other kwargs.
+
+    The weights of the epoch with the best validation loss are kept in memory
+    and loaded at the end (`checkpoint='memory'`, and then saved to a new file
+    in `checkpoint_dir` if given, see `MemoryCheckpoint`), or written to
+    `f_checkpoint` on every improvement (`checkpoint='disk'`), or not kept
+    (`checkpoint=False`).
+    Training stops after `max_epochs`, or earlier after `patience` epochs
+    without an improvement of at least `min_delta` in validation loss, or
+    after `time_budget` seconds.
+    """
+
     model = kwargs.pop('model', None)
     if model is None:
         hl_size = kwargs.pop('hidden_layer_sizes', [100, 100])
@@ -56,35 +82,85 @@ def default_skorch_nnet(reg=True, insize=14, outsize=6, **kwargs):
         outact = kwargs.pop('outact', default_outact)
         model = build_pytorch_nnet([insize] + list(hl_size) + [outsize],
                                    output_activation=outact, activation=activation)
+    engine = kwargs.pop('engine', 'minibatch')
+    if engine not in TRAINING_ENGINES:
+        raise ValueError(f"engine should be one of {TRAINING_ENGINES}, was {engine}")
+    net_class = skorch.NeuralNetRegressor
+    weight_decay = 1e-4 if reg else 1
+    if engine != 'minibatch':
+        # The whole training set as one tensor batch
+        kwargs.setdefault('batch_size', -1)
+        kwargs.setdefault('batch_iterator', 'tensor')
+        # The uncertainty loss is a sum (not a mean) over the batch, so the
+        # weight decay has to grow with the batch size (~3000 / 200 galaxies)
+        weight_decay = 1e-4 if reg else 10
+    if engine == 'fullbatch':
+        kwargs.setdefault('lr', 1e-2 if reg else 3e-3)
+        kwargs.setdefault('max_epochs', 500 if reg else 200)
+        # A single annealing cycle
+        kwargs.setdefault('lr_policy_kwargs', {'T_max': kwargs['max_epochs']})
+    elif engine == 'lbfgs':
+        # LBFGS has no weight decay: add the equivalent L2 penalty to the loss
+        net_class = L2NeuralNetRegressor
+        kwargs.setdefault('lambda2', kwargs.pop('optimizer__weight_decay', weight_decay))
+        kwargs.setdefault('optimizer', torch.optim.LBFGS)
+        kwargs.setdefault('lr', 1)
+        kwargs.setdefault('optimizer__max_iter', 10)
+        kwargs.setdefault('optimizer__line_search_fn', 'strong_wolfe')
+        kwargs.setdefault('lr_policy', None)
+        kwargs.setdefault('max_epochs', 30 if reg else 10)
     kwargs.setdefault('lr', 1e-3)
     kwargs.setdefault('batch_size', 200)
     kwargs.setdefault('verbose', True)
     kwargs.setdefault('warm_start', True)
     kwargs.setdefault('optimizer', torch.optim.Adam)
+    batch_iterator = kwargs.pop('batch_iterator', 'dataloader')
+    if batch_iterator == 'tensor':
+        kwargs.setdefault('iterator_train', TensorBatchIterator)
+        kwargs.setdefault('iterator_valid', TensorBatchIterator)
+    elif batch_iterator != 'dataloader':
+        raise ValueError(f"batch_iterator should be 'dataloader' or 'tensor', "
+                         f"was {batch_iterator}")
     lr_policy = kwargs.pop('lr_policy', 'CosineAnnealingLR')
     lr_policy_kwargs = kwargs.pop('lr_policy_kwargs', {})
     lr_policy_kwargs.setdefault('T_max', 50)
-    checkpoint = kwargs.pop('checkpoint', True)
+    checkpoint = kwargs.pop('checkpoint', 'memory')
     suff = 'reg' if reg else 'unc'
-    f_param = kwargs.pop('checkpoint',
+    f_param = kwargs.pop('f_checkpoint',
         f'./models/checkpoints/{suff}.pt')
-    callbacks = [skorch.callbacks.LRScheduler(policy=lr_policy, **lr_policy_kwargs)]
-    if checkpoint:
+    checkpoint_dir = kwargs.pop('checkpoint_dir', None)
+    patience = kwargs.pop('patience', None)
+    min_delta = kwargs.pop('min_delta', 0)
+    time_budget = kwargs.pop('time_budget', None)
+    callbacks = []
+    if lr_policy is not None:
+        callbacks.append(skorch.callbacks.LRScheduler(policy=lr_policy, **lr_policy_kwargs))
+    if checkpoint is True or checkpoint == 'memory':
+        callbacks.append(MemoryCheckpoint(flush_dir=checkpoint_dir, prefix=suff))
+    elif checkpoint == 'disk':
         if not os.path.isdir(os.path.dirname(f_param)):
             os.makedirs(os.path.dirname(f_param))
         # Disable saving history and optimizer state
         callbacks.append(skorch.callbacks.Checkpoint(f_params=f_param, f_history=None,
                                                      f_optimizer=None))
         callbacks.append(LoadCheckPointer(f_param))
+    elif checkpoint:
+        raise ValueError(f"checkpoint should be 'memory', 'disk' or False, was {checkpoint}")
+    # After the checkpoint, so the best epoch is kept when stopping
+    if patience is not None:
+        callbacks.append(skorch.callbacks.EarlyStopping(
+            patience=patience, threshold=min_delta, threshold_mode='abs'))
+    if time_budget is not None:
+        callbacks.append(TimeBudget(time_budget))
     kwargs.setdefault('callbacks', callbacks)
+    if engine != 'lbfgs':
+        kwargs.setdefault('optimizer__weight_decay', weight_decay)
     if reg:
-        kwargs.setdefault('optimizer__weight_decay', 1e-4)
         kwargs.setdefault('max_epochs', 150)
     else:
-        kwargs.setdefault('optimizer__weight_decay', 1)
         kwargs.setdefault('max_epochs', 50)
         kwargs.setdefault('criterion', create_uncertainty_loss)
-    return skorch.NeuralNetRegressor(model, **kwargs)
+    return net_class(model, **kwargs)
 
 def default_scaled_nnet(**skorchnet_kwargs):
     skorch_nnet = default_skorch_nnet(**skorchnet_kwargs)
@@ -94,6 +170,24 @@ def default_scaled_nnet(**skorchnet_kwargs):
                                       check_inverse=False)
     return regr
 
+class L2NeuralNetRegressor(skorch.NeuralNetRegressor):
+    """
+    NeuralNetRegressor with an L2 penalty lambda2/2 * sum(w^2) on all
+    parameters in the training loss, i.e. the weight decay for optimizers
+    that do not have it (LBFGS). The validation loss is without penalty.
+    """
+
+    def __init__(self, *args, lambda2=0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lambda2 = lambda2
+
+    def get_loss(self, y_pred, y_true, X=None, training=False):
+        loss = super().get_loss(y_pred, y_true, X=X, training=training)
+        if training and self.lambda2:
+            penalty = sum(torch.sum(param**2) for param in self.module_.parameters())
+            loss = loss + 0.5 * self.lambda2 * penalty
+        return loss
+
 class LoadCheckPointer(skorch.callbacks.Callback):
     """Class that loads the last checkpoint (i.e. best validation score) on train end."""
 
@@ -104,6 +198,141 @@ class LoadCheckPointer(skorch.callbacks.Callback):
     def on_train_end(self, net, X, y):
         net.module_.load_state_dict(torch.load(self.f_params))
 
+class MemoryCheckpoint(skorch.callbacks.Callback):
+    """
+    Keeps a copy of the module weights of the epoch with the best validation
+    loss in memory, and loads them on train end (like `skorch.Checkpoint`
+    followed by `LoadCheckPointer`, without the disk I/O).
+
+    Parameters
+    ----------
+    monitor : string, default 'valid_loss_best'
+    flush_dir : path or None, default None
+        If given, the best weights are also saved on train end, in a
+        background thread, to a new file `<flush_dir>/<prefix>-<pid>-<id>.pt`
+        (so concurrent trainings don't overwrite each other). The path is in
+        `f_params_`. Use `wait()` to wait until it is written.
+    prefix : string, default 'params'
+    """
+
+    def __init__(self, monitor='valid_loss_best', flush_dir=None, prefix='params'):
+        super(MemoryCheckpoint, self).__init__()
+        self.monitor = monitor
+        self.flush_dir = flush_dir
+        self.prefix = prefix
+
+    def on_train_begin(self, net, X=None, y=None, **kwargs):
+        self.best_state_ = None
+        self.f_params_ = None
+
+    def on_epoch_end(self, net, **kwargs):
+        if net.history[-1, self.monitor]:
+            self.best_state_ = {key: value.detach().clone()
+                                for key, value in net.module_.state_dict().items()}
+
+    def on_train_end(self, net, X=None, y=None, **kwargs):
+        if self.best_state_ is not None:
+            net.module_.load_state_dict(self.best_state_)
+            if self.flush_dir is not None:
+                self._flush(self.best_state_, net.verbose)
+        # Don't keep (and pickle) a second copy of the weights
+        self.best_state_ = None
+
+    def wait(self):
+        """Wait for the file of the last flush to be written"""
+
+        thread = self.__dict__.pop('_flush_thread', None)
+        if thread is not None:
+            thread.join()
+
+    def _flush(self, state, verbose):
+        self.wait()
+        os.makedirs(self.flush_dir, exist_ok=True)
+        self.f_params_ = os.path.join(
+            self.flush_dir, f'{self.prefix}-{os.getpid()}-{uuid.uuid4().hex[:8]}.pt')
+        if verbose:
+            print(f'Saving the best weights to {self.f_params_}')
+        self._flush_thread = threading.Thread(target=torch.save,
+                                              args=(state, self.f_params_))
+        self._flush_thread.start()
+
+    def __getstate__(self):
+        # Threads can't be pickled (or deep-copied by sklearn's clone)
+        self.wait()
+        return self.__dict__.copy()
+
+class TimeBudget(skorch.callbacks.Callback):
+    """Stops training after the epoch in which `budget` seconds have passed"""
+
+    def __init__(self, budget):
+        super(TimeBudget, self).__init__()
+        self.budget = budget
+
+    def on_train_begin(self, net, X=None, y=None, **kwargs):
+        self.start_ = time.perf_counter()
+
+    def on_epoch_end(self, net, **kwargs):
+        if time.perf_counter() - self.start_ > self.budget:
+            if net.verbose:
+                print(f'Stopping after the time budget of {self.budget} s.')
+            raise KeyboardInterrupt
+
+class TensorBatchIterator:
+    """
+    Replacement of the torch DataLoader for skorch's `iterator_train` and
+    `iterator_valid` (use `default_skorch_nnet(batch_iterator='tensor')`).
+
+    The data of the (skorch) dataset is converted once to contiguous tensors,
+    and the batches are slices of these tensors, so there is no per-sample
+    indexing and collation. Without shuffling (`shuffle=False`, e.g. the
+    validation batches), the batches are identical to those of the
+    DataLoader. With shuffling, the permutation differs from that of the
+    DataLoader's sampler, so the batches and trained weights differ too.
+    """
+
+    def __init__(self, dataset, batch_size=128, shuffle=False, **kwargs):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.X, self.y = self._get_tensors(dataset)
+
+    def __len__(self):
+        return (len(self.X) + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        X, y = self.X, self.y
+        if self.shuffle:
+            permutation = torch.randperm(len(X))
+            X = X[permutation]
+            y = y[permutation] if y is not None else None
+        for start in range(0, len(X), self.batch_size):
+            stop = start + self.batch_size
+            yield X[start:stop], (y[start:stop] if y is not None else None)
+
+    @staticmethod
+    def _get_tensors(dataset):
+        # Cached on the dataset, which skorch reuses for every epoch
+        tensors = getattr(dataset, '_batch_tensors', None)
+        if tensors is not None:
+            return tensors
+        indices = None
+        if isinstance(dataset, torch.utils.data.Subset):
+            indices = torch.as_tensor(np.asarray(dataset.indices))
+            dataset = dataset.dataset
+        tensors = []
+        for data in [dataset.X, dataset.y]:
+            if data is not None:
+                data = torch.as_tensor(np.asarray(data))
+                data = data[indices] if indices is not None else data
+                data = data.contiguous()
+            tensors.append(data)
+        tensors = tuple(tensors)
+        try:
+            dataset._batch_tensors = tensors
+        except AttributeError:
+            pass
+        return tensors
+
 def create_uncertainty_loss():
     def softplus_loss(outputs, labels):
         '''
@@ -1,13 +1,31 @@
+import json
 from pathlib import Path
 import pickle
+import numpy as np
+import pandas as pd
 from .fullsetpredictor import FullSetPredictor
+from .inference import MLPEngine, RegUncEngine, EnsembleRegUncEngine
 from .modelbuilder import create_uncertainty_loss
+from .preprocessing import FeatureSelect, LogNormaliser
 from .reguncpredictor import RegUncPredictor
 from .singlepredictor import SinglePredictor, SingleRegressor, SingleUncertaintyEstimator
 from .util import get_neuralnetregressor
 
+# Version of the directory format written by `ModelStore.export`
+FORMAT_VERSION = 1
+
 class ModelStore:
-    """Class for saving and loading ML models"""
+    """
+    Class for saving and loading ML models.
+
+    Models are stored either as a pickle of the whole predictor (`store`,
+    `<name>.pkl`), or in a compact versioned directory format (`export`,
+    `<name>/meta.json` and `<name>/arrays.npz`) with only the weights, the
+    scalers, the correction factors and the train/test ids. The latter can
+    be opened lazily for inference (`open`, `load_engine`) without the
+    training pipeline or `d_data`. `load` and `load_engine` read either
+    format (the directory first); `convert` turns a pickle into a directory.
+    """
 
     def __init__(self, savedir='./models/'):
         self.savedir = Path(savedir)
@@ -26,28 +44,180 @@ class ModelStore:
         # Callback after save (e.g. unstringify loss)
         callback()
 
+    def export(self, model, name='nnet', **meta_kwargs):
+        """
+        Save a trained SinglePredictor, RegUncPredictor or FullSetPredictor
+        in the directory format. The meta_kwargs should be JSON serialisable.
+        """
+
+        saveobj, callback = self._get_saveobj(model, False, **meta_kwargs)
+        callback()
+        self._write_directory(saveobj, name)
+
+    def convert(self, name, new_name=None):
+        """Convert the pickle of `store` to the directory format of `export`"""
+
+        self._write_directory(self._read_saveobj(name),
+                              name if new_name is None else new_name)
+
+    def open(self, name='nnet'):
+        """Open a model of the directory format (see `StoredModel`)"""
+
+        return StoredModel(self.savedir / name)
+
+    def has_directory(self, name):
+        return (self.savedir / name / 'meta.json').exists()
+
     def load(self, d_data, name='nnet', **kwargs):
-        """Load model from disk. The training history is not saved/loaded."""
+        """
+        Load model from disk. The training history is not saved/loaded.
+        `d_data` is a dict of DataFrames or a `GalaxyTable`.
+        """
 
-        savefile = self.savedir / f'{name}.pkl'
-        with savefile.open('rb') as inf:
-            saveobj = pickle.load(inf)
+        if self.has_directory(name):
+            saveobj = self.open(name).to_saveobj()
+        else:
+            saveobj = self._read_saveobj(name)
+        return self._load_saveobj(saveobj, d_data, **kwargs)
+
+    @staticmethod
+    def _load_saveobj(saveobj, d_data, **kwargs):
         classname = saveobj['classname']
         if ((classname == 'SingleRegressor') or
             (classname == 'SingleUncertaintyEstimator')):
-            return self._load_singlepredictor(saveobj, d_data, **kwargs)
+            return ModelStore._load_singlepredictor(saveobj, d_data, **kwargs)
         elif classname == 'RegUncPredictor':
-            return self._load_reguncpredictor(saveobj, d_data)
+            return ModelStore._load_reguncpredictor(saveobj, d_data)
         elif classname == 'FullSetPredictor':
             fspred = FullSetPredictor(d_data)
             # Individual predictors are stored as saveobj['pred 0'] etc,
             # with saveobj['prednames'] = ['pred 0', 'pred 1', ...]
             for predname in saveobj['prednames']:
-                pred = self._load_reguncpredictor(saveobj[predname], d_data)
+                pred = ModelStore._load_reguncpredictor(saveobj[predname], d_data)
                 fspred.predictors.append(pred)
             return fspred
         else:
-            ValueError("Invalid loaded classname", classname)
+            raise ValueError("Invalid loaded classname", classname)
+
+    def load_engine(self, name='nnet', dtype=np.float32):
+        """
+        Load a RegUncPredictor or FullSetPredictor from disk as an inference
+        engine (`RegUncEngine` or `EnsembleRegUncEngine`). Does not need
+        `d_data`: the data is not preprocessed and no predictions are made.
+        """
+
+        if self.has_directory(name):
+            return self.open(name).engine(dtype=dtype)
+        saveobj = self._read_saveobj(name)
+        classname = saveobj['classname']
+        if classname == 'RegUncPredictor':
+            return self._get_reguncengine(saveobj, dtype)
+        elif classname == 'FullSetPredictor':
+            return EnsembleRegUncEngine.from_engines(
+                [self._get_reguncengine(saveobj[predname], dtype)
+                 for predname in saveobj['prednames']])
+        raise ValueError(f"Cannot load {classname} as an engine, it should be a "
+                         "RegUncPredictor or FullSetPredictor")
+
+    def load_preprocessing(self, name='nnet'):
+        """
+        The feature and target columns and the LogNormaliser settings of the
+        regressor and the uncertainty estimator of a RegUncPredictor or
+        FullSetPredictor on disk, as {'reg': {...}, 'unc': {...}} (see
+        `predict.CataloguePredictor`).
+        """
+
+        if self.has_directory(name):
+            return self.open(name).preprocessing()
+        saveobj = self._read_saveobj(name)
+        classname = saveobj['classname']
+        if classname == 'FullSetPredictor':
+            # The same for every fold
+            saveobj = saveobj[saveobj['prednames'][0]]
+        elif classname != 'RegUncPredictor':
+            raise ValueError(f"{classname} has no regressor and uncertainty estimator, "
+                             "it should be a RegUncPredictor or FullSetPredictor")
+        return {key: self._get_preprocessing(saveobj[key], key == 'reg')
+                for key in ['reg', 'unc']}
+
+    def _read_saveobj(self, name):
+        savefile = self.savedir / f'{name}.pkl'
+        with savefile.open('rb') as inf:
+            return pickle.load(inf)
+
+    def _write_directory(self, saveobj, name):
+        classname = saveobj['classname']
+        reserved = ['classname', 'prednames', 'model', 'stringify_loss', 'idx_train',
+                    'idx_test', 'correction_factor', 'x_columns', 'y_columns',
+                    'normaliser', 'reg', 'unc']
+        info = {'format': 'firenet-model', 'version': FORMAT_VERSION,
+                'classname': classname,
+                'meta': {key: value for key, value in saveobj.items()
+                         if key not in reserved and key not in saveobj.get('prednames', [])}}
+        arrays = {}
+        if classname in ['SingleRegressor', 'SingleUncertaintyEstimator']:
+            info['predictor'] = self._single_to_arrays(saveobj, classname, '', arrays)
+        else:
+            li_saveobj = ([saveobj[predname] for predname in saveobj['prednames']]
+                          if classname == 'FullSetPredictor' else [saveobj])
+            info['predictors'] = [
+                {key: self._single_to_arrays(saveobj_pred[key], singlename,
+                                             f'{i}/{key}/', arrays)
+                 for key, singlename in [('reg', 'SingleRegressor'),
+                                         ('unc', 'SingleUncertaintyEstimator')]}
+                for i, saveobj_pred in enumerate(li_saveobj)]
+        directory = self.savedir / name
+        directory.mkdir(parents=True, exist_ok=True)
+        np.savez_compressed(directory / 'arrays.npz', **arrays)
+        # Written last: the directory is only used once meta.json exists
+        with (directory / 'meta.json').open('w') as outf:
+            json.dump(info, outf, indent=1, default=str)
+
+    @staticmethod
+    def _single_to_arrays(saveobj, classname, prefix, arrays):
+        model = saveobj['model']
+        weights, biases, activations, in_scaling, out_scaling = \
+            MLPEngine._unpack_model(model)
+        for i, (weight, bias) in enumerate(zip(weights, biases)):
+            arrays[f'{prefix}weight{i}'] = weight.astype(np.float32)
+            arrays[f'{prefix}bias{i}'] = bias.astype(np.float32)
+        for key, scaling in [('x', in_scaling), ('y', out_scaling)]:
+            if scaling is not None:
+                arrays[f'{prefix}{key}_mean'], arrays[f'{prefix}{key}_scale'] = scaling
+        for key in ['idx_train', 'idx_test']:
+            index = np.asarray(saveobj[key])
+            arrays[f'{prefix}{key}'] = index.astype(str) if index.dtype == object else index
+        correction_factor = saveobj['correction_factor']
+        if isinstance(correction_factor, pd.Series):
+            correction_factor = {'values': correction_factor.tolist(),
+                                 'name': correction_factor.name}
+        return {'classname': classname, 'activations': activations,
+                'steps': [stepname for stepname, _ in model.steps],
+                'correction_factor': correction_factor,
+                **ModelStore._get_preprocessing(saveobj, classname == 'SingleRegressor')}
+
+    @staticmethod
+    def _get_preprocessing(saveobj, reg):
+        """The feature and target columns and the LogNormaliser settings"""
+
+        if 'normaliser' in saveobj:
+            return {key: saveobj[key] for key in ['x_columns', 'y_columns', 'normaliser']}
+        # Stored before these were saved: the defaults of SinglePredictor.preprocess
+        x_columns = (list(FeatureSelect.uvmir_bands) if reg
+                     else FeatureSelect.xunc_columns())
+        normaliser = LogNormaliser(ignore_bands=[col for col in x_columns
+                                                 if col not in FeatureSelect.uvmir_bands])
+        return {'x_columns': x_columns, 'y_columns': list(FeatureSelect.fir_bands),
+                'normaliser': {'normalise_band': normaliser.normalise_band,
+                               'ignore_bands': normaliser.ignore_bands}}
+
+    @staticmethod
+    def _get_reguncengine(saveobj, dtype):
+        # The loss of the uncertainty estimator is not needed for inference
+        engines = [MLPEngine.from_model(saveobj[key]['model'],
+                                        saveobj[key]['correction_factor'], dtype=dtype)
+                   for key in ['reg', 'unc']]
+        return RegUncEngine(*engines, target_columns=list(FeatureSelect.fir_bands))
 
     @staticmethod
     def _get_saveobj(model, stringify_loss, **meta_kwargs):
@@ -102,10 +272,15 @@ class ModelStore:
             if stringify_loss:
                 criterion = nnet.criterion_
                 nnet.criterion_ = str(nnet.criterion_)
+        log_normaliser = singlepredictor.log_normaliser
         saveobj = {'model': singlepredictor.model, 'stringify_loss': stringify_loss,
                     'idx_train': singlepredictor.X_train.index,
                     'idx_test': singlepredictor.X_test.index,
-                    'correction_factor': singlepredictor.correction_factor}
+                    'correction_factor': singlepredictor.correction_factor,
+                    'x_columns': list(singlepredictor.X.columns),
+                    'y_columns': list(singlepredictor.Y.columns),
+                    'normaliser': {'normalise_band': log_normaliser.normalise_band,
+                                   'ignore_bands': list(log_normaliser.ignore_bands)}}
         def callback():
             if stringify_loss and is_skorch_model:
                 nnet.criterion_ = criterion
@@ -129,7 +304,8 @@ class ModelStore:
         d_reg_class = {True: SingleRegressor, 
                        False: SingleUncertaintyEstimator}
         pred = d_reg_class[reg](d_data)  # instantiate predictor
-        kwargs = {}
+        # Normalise as in training (not saved in old models: the defaults)
+        kwargs = dict(saveobj.get('normaliser', {}))
         if not reg:
             kwargs['Y_pred'] = Y_pred
         pred.preprocess(saveobj['idx_train'], saveobj['idx_test'],
@@ -152,4 +328,184 @@ class ModelStore:
         if 'create_uncertainty_loss' in nnet.criterion_:
             nnet.criterion_ = create_uncertainty_loss()
         else:
-            raise ValueError(f"Unknown uncertainty loss '{nnet.criterion_}'")
\ No newline at end of file
+            raise ValueError(f"Unknown uncertainty loss '{nnet.criterion_}'")
+
+class StoredModel:
+    """
+    A model in the directory format of `ModelStore.export`. Opening it only
+    reads `meta.json`; the arrays are read when needed, and the training
+    pipeline (sklearn, skorch) is only rebuilt by `load`.
+
+    Parameters
+    ----------
+    path : path
+        The model directory.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with (self.path / 'meta.json').open() as inf:
+            self.info = json.load(inf)
+        if self.info.get('format') != 'firenet-model':
+            raise ValueError(f'{self.path} is not a FIRE-net model directory')
+        if self.info['version'] > FORMAT_VERSION:
+            raise ValueError(f"{self.path} has format version {self.info['version']}, "
+                             f"this version of firenet reads up to {FORMAT_VERSION}")
+        self.classname = self.info['classname']
+        self.meta = self.info['meta']
+
+    def _entries(self):
+        """(prefix, single predictor info) of each stored network"""
+
+        if 'predictor' in self.info:
+            return [('', self.info['predictor'])]
+        return [(f'{i}/{key}/', predictor[key])
+                for i, predictor in enumerate(self.info['predictors'])
+                for key in ['reg', 'unc']]
+
+    def engine(self, dtype=np.float32):
+        """
+        The inference engine: an `MLPEngine` (single predictor),
+        `RegUncEngine` or `EnsembleRegUncEngine` (FullSetPredictor).
+        """
+
+        with np.load(self.path / 'arrays.npz') as arrays:
+            engines = [self._get_engine(entry, prefix, arrays, dtype)
+                       for prefix, entry in self._entries()]
+        if 'predictor' in self.info:
+            return engines[0]
+        target_columns = self._entries()[0][1]['y_columns']
+        reguncengines = [RegUncEngine(reg, unc, target_columns=target_columns)
+                         for reg, unc in zip(engines[::2], engines[1::2])]
+        if self.classname == 'FullSetPredictor':
+            return EnsembleRegUncEngine.from_engines(reguncengines)
+        return reguncengines[0]
+
+    def preprocessing(self):
+        """As `ModelStore.load_preprocessing`"""
+
+        if 'predictor' in self.info:
+            raise ValueError(f"{self.classname} has no regressor and uncertainty "
+                             "estimator, it should be a RegUncPredictor or FullSetPredictor")
+        return {key: {column: self.info['predictors'][0][key][column]
+                      for column in ['x_columns', 'y_columns', 'normaliser']}
+                for key in ['reg', 'unc']}
+
+    def load(self, d_data):
+        """The trained predictor (as `ModelStore.load`)"""
+
+        return ModelStore._load_saveobj(self.to_saveobj(), d_data)
+
+    def to_saveobj(self):
+        """The save object of `ModelStore.store`, with rebuilt pipelines"""
+
+        with np.load(self.path / 'arrays.npz') as arrays:
+            li_saveobj = [self._get_single_saveobj(entry, prefix, arrays)
+                          for prefix, entry in self._entries()]
+        saveobj = dict(self.meta, classname=self.classname)
+        if 'predictor' in self.info:
+            saveobj.update(li_saveobj[0])
+            return saveobj
+        li_saveobj = [{'classname': 'RegUncPredictor', 'reg': reg, 'unc': unc}
+                      for reg, unc in zip(li_saveobj[::2], li_saveobj[1::2])]
+        if self.classname == 'FullSetPredictor':
+            saveobj['prednames'] = [f'pred {i}' for i in range(len(li_saveobj))]
+            for predname, saveobj_pred in zip(saveobj['prednames'], li_saveobj):
+                saveobj[predname] = saveobj_pred
+            return saveobj
+        saveobj.update(li_saveobj[0])
+        return saveobj
+
+    @staticmethod
+    def _get_layers(entry, prefix, arrays):
+        n_layers = len(entry['activations'])
+        weights = [arrays[f'{prefix}weight{i}'] for i in range(n_layers)]
+        biases = [arrays[f'{prefix}bias{i}'] for i in range(n_layers)]
+        activations = [tuple(act) if act is not None else None
+                       for act in entry['activations']]
+        scalings = [(arrays[f'{prefix}{key}_mean'], arrays[f'{prefix}{key}_scale'])
+                    if f'{prefix}{key}_mean' in arrays else None for key in ['x', 'y']]
+        return weights, biases, activations, scalings[0], scalings[1]
+
+    @staticmethod
+    def _get_correction_factor(entry):
+        correction_factor = entry['correction_factor']
+        if isinstance(correction_factor, dict):
+            return pd.Series(correction_factor['values'], index=entry['y_columns'],
+                             name=correction_factor['name'])
+        return correction_factor
+
+    def _get_engine(self, entry, prefix, arrays, dtype):
+        correction_factor = self._get_correction_factor(entry)
+        if isinstance(correction_factor, pd.Series):
+            correction_factor = correction_factor.values
+        return MLPEngine.from_arrays(*self._get_layers(entry, prefix, arrays),
+                                     correction_factor=correction_factor, dtype=dtype)
+
+    def _get_single_saveobj(self, entry, prefix, arrays):
+        idx = {}
+        for key in ['idx_train', 'idx_test']:
+            index = arrays[f'{prefix}{key}']
+            idx[key] = pd.Index(index.astype(object) if index.dtype.kind == 'U' else index)
+        model = self._build_model(entry, *self._get_layers(entry, prefix, arrays),
+                                  n_samples=len(idx['idx_train']))
+        return {'model': model,
+                'stringify_loss': False, 'correction_factor': self._get_correction_factor(entry),
+                'x_columns': entry['x_columns'], 'y_columns': entry['y_columns'],
+                'normaliser': entry['normaliser'], **idx}
+
+    @staticmethod
+    def _build_model(entry, weights, biases, activations, in_scaling, out_scaling,
+                     n_samples):
+        """Rebuild the fitted sklearn Pipeline of a single predictor"""
+
+        import torch
+        from sklearn.compose import TransformedTargetRegressor
+        from sklearn.pipeline import Pipeline
+        from sklearn.preprocessing import StandardScaler
+        from .modelbuilder import default_skorch_nnet
+
+        def fitted_scaler(scaling):
+            scaler = StandardScaler()
+            scaler.mean_, scaler.scale_ = [np.array(a, dtype=np.float64) for a in scaling]
+            scaler.var_ = scaler.scale_**2
+            scaler.n_features_in_ = len(scaler.mean_)
+            # The scalers are fitted on the whole training set
+            scaler.n_samples_seen_ = n_samples
+            return scaler
+
+        layers = []
+        for weight, bias, activation in zip(weights, biases, activations):
+            layers.append(torch.nn.Linear(*weight.shape))
+            if activation is not None:
+                name, params = activation
+                layers.append(getattr(torch.nn, name)(**params))
+        reg = entry['classname'] == 'SingleRegressor'
+        net = default_skorch_nnet(reg=reg, model=torch.nn.Sequential(*layers), verbose=False)
+        estimator = net
+        if out_scaling is None:
+            net.initialize()
+        else:
+            estimator = TransformedTargetRegressor(regressor=net, transformer=StandardScaler(),
+                                                   check_inverse=False)
+            # Fit for 0 epochs (on dummy data), only to initialise the fitted
+            # clone of the network; the weights and the scaler are set below
+            max_epochs = net.max_epochs
+            estimator.set_params(regressor__max_epochs=0)
+            n_in, n_out = weights[0].shape[0], weights[-1].shape[1]
+            estimator.fit(np.zeros((10, n_in), dtype=np.float32),
+                          np.ones((10, n_out), dtype=np.float32))
+            estimator.set_params(regressor__max_epochs=max_epochs)
+            net = estimator.regressor_
+            net.set_params(max_epochs=max_epochs)
+            estimator.transformer_ = fitted_scaler(out_scaling)
+        linears = [layer for layer in net.module_ if isinstance(layer, torch.nn.Linear)]
+        with torch.no_grad():
+            for layer, weight, bias in zip(linears, weights, biases):
+                layer.weight.copy_(torch.as_tensor(np.ascontiguousarray(weight.T)))
+                layer.bias.copy_(torch.as_tensor(bias))
+        steps = []
+        if in_scaling is not None:
+            steps.append((entry['steps'][0], fitted_scaler(in_scaling)))
+        steps.append((entry['steps'][-1], estimator))
+        return Pipeline(steps)
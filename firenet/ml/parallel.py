@@ -0,0 +1,115 @@
+"""
+Process-parallel helpers for inference on large catalogues.
+"""
+from collections import deque
+from contextlib import contextmanager
+import multiprocessing
+import os
+import sys
+
+# Environment variables read by the BLAS / OpenMP thread pools at start-up
+THREAD_ENV_VARS = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                   'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS']
+
+def limit_threads(n_threads=1):
+    """
+    Limit the number of threads of numpy's BLAS and torch in this process,
+    e.g. in each worker of a process pool, to avoid oversubscribing the CPUs.
+    """
+
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(n_threads)
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(n_threads)
+    except ImportError:
+        pass
+    # Only if it is loaded already (importing torch is slow)
+    torch = sys.modules.get('torch')
+    if torch is not None:
+        torch.set_num_threads(n_threads)
+
+@contextmanager
+def thread_limits(n_threads=1):
+    """
+    Context manager version of `limit_threads` for the current process: the
+    BLAS and torch thread limits are restored on exit. The environment
+    variables are not changed. If `n_threads` is None, nothing is limited.
+    """
+
+    if n_threads is None:
+        yield
+        return
+    torch = sys.modules.get('torch')
+    torch_threads = torch.get_num_threads() if torch is not None else None
+    try:
+        from threadpoolctl import threadpool_limits
+        limits = threadpool_limits(n_threads)
+    except ImportError:
+        limits = None
+    if torch is not None:
+        torch.set_num_threads(n_threads)
+    try:
+        yield
+    finally:
+        if limits is not None:
+            limits.restore_original_limits()
+        if torch is not None:
+            torch.set_num_threads(torch_threads)
+
+def default_n_threads(n_jobs):
+    """Threads per worker, so n_jobs workers use each CPU once"""
+
+    return max(1, (os.cpu_count() or 1) // n_jobs)
+
+# The object of each worker process (see `ordered_parallel_map`)
+_worker_state = {}
+
+def _init_worker(obj, n_threads):
+    limit_threads(n_threads)
+    _worker_state['obj'] = obj
+
+def _call_worker(methodname, item):
+    return getattr(_worker_state['obj'], methodname)(item)
+
+def ordered_parallel_map(obj, methodname, iterable, n_jobs, n_threads=None,
+                         max_in_flight=None):
+    """
+    Apply `obj.<methodname>` to each item of `iterable` in a pool of worker
+    processes, yielding the results in the input order.
+
+    `obj` (e.g. a model) is sent to each worker once. With the fork start
+    method (POSIX) it is not even copied: the workers share its memory pages.
+    Idle workers take the next item, so uneven items are balanced. At most
+    `max_in_flight` items are read ahead of the consumer, which bounds the
+    memory for large (streamed) inputs.
+
+    Parameters
+    ----------
+    obj : object
+    methodname : string
+    iterable : iterable
+    n_jobs : int
+        Number of worker processes.
+    n_threads : int or None, default None
+        Threads per worker (see `limit_threads`). If None, divide the CPUs
+        over the workers.
+    max_in_flight : int or None, default None
+        If None, 2 * n_jobs.
+    """
+
+    if n_threads is None:
+        n_threads = default_n_threads(n_jobs)
+    if max_in_flight is None:
+        max_in_flight = 2 * n_jobs
+    start_method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+    context = multiprocessing.get_context(start_method)
+    with context.Pool(n_jobs, initializer=_init_worker,
+                      initargs=(obj, n_threads)) as pool:
+        pending = deque()
+        for item in iterable:
+            pending.append(pool.apply_async(_call_worker, (methodname, item)))
+            if len(pending) >= max_in_flight:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
@@ -1,5 +1,7 @@
 import numpy as np
 import pandas as pd
+from ..galaxytable import GalaxyTable
+from ..util import uncertainty_features
 
 class LogNormaliser:
     """
@@ -7,35 +9,83 @@ class LogNormaliser:
     
     Not sklearn Transformer compatible, since we transform both X and y,
     which is not (yet) supported by scikit-learn.
+
+    The DataFrame methods (`transform`, `inverse_transform`) go through the
+    array methods (`transform_array`, `inverse_transform_array`), which can
+    also be used directly after `set_columns`. Float32 arrays stay float32.
     """
 
     def __init__(self, normalise_band='WISE_3.4', ignore_bands=None, copy=True):
         self.normalise_band = normalise_band
         self.copy = copy
         self.ignore_bands = list(ignore_bands) if ignore_bands is not None else []
-        if not normalise_band in ignore_bands:
+        if not normalise_band in self.ignore_bands:
             self.ignore_bands.append(normalise_band)
     
+    def set_columns(self, x_columns, y_columns=None):
+        """
+        Set the columns of the arrays passed to `transform_array` and
+        `inverse_transform_array`, and precompute which are normalised.
+        """
+
+        x_columns = pd.Index(x_columns)
+        if self.normalise_band not in x_columns:
+            raise ValueError(f"Normaliseband ({self.normalise_band}) not in features!")
+        self._norm_col = x_columns.get_loc(self.normalise_band)
+        # The normalise band itself is in ignore_bands
+        self._x_used = ~x_columns.isin(self.ignore_bands)
+        self._y_used = None
+        if y_columns is not None:
+            self._y_used = ~pd.Index(y_columns).isin(self.ignore_bands)
+        return self
+
     def transform(self, X, y=None):
         self._check_dataframes(X, y)
-        normalise_flux = X[self.normalise_band].copy()
-        X = self._log_normalise_df(X, normalise_flux)
-        X[self.normalise_band] = np.log10(normalise_flux)
-        if y is not None:
-            y = self._log_normalise_df(y, normalise_flux)
-            return X, y
-        return X
+        self.set_columns(X.columns, None if y is None else y.columns)
+        X_arr, y_arr = self._get_arrays(X, y)
+        self._transform_inplace(X_arr, y_arr)
+        return self._to_dataframes(X, y, X_arr, y_arr)
 
     def inverse_transform(self, X, y=None):
         self._check_dataframes(X, y)
-        normalise_flux = np.power(10, X[self.normalise_band].copy())
-        X = self._unnormalise_df(X, normalise_flux)
-        X[self.normalise_band] = normalise_flux
-        if y is not None:
-            y = self._unnormalise_df(y, normalise_flux)
-            return X, y
-        return X
-        
+        self.set_columns(X.columns, None if y is None else y.columns)
+        X_arr, y_arr = self._get_arrays(X, y)
+        self._inverse_transform_inplace(X_arr, y_arr)
+        return self._to_dataframes(X, y, X_arr, y_arr)
+
+    def transform_array(self, X, y=None):
+        """
+        Log normalise arrays with the columns of `set_columns`. Works in
+        place if `copy` is False (and the arrays are float).
+        """
+
+        X, y = self._check_arrays(X, y)
+        self._transform_inplace(X, y)
+        return X if y is None else (X, y)
+
+    def inverse_transform_array(self, X, y=None):
+        """Inverse of `transform_array`"""
+
+        X, y = self._check_arrays(X, y)
+        self._inverse_transform_inplace(X, y)
+        return X if y is None else (X, y)
+
+    def _transform_inplace(self, X, y):
+        normalise_flux = X[:, self._norm_col].copy()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self._log_normalise_array(X, self._x_used, normalise_flux)
+            np.log10(normalise_flux, out=X[:, self._norm_col])
+            if y is not None:
+                self._log_normalise_array(y, self._y_used, normalise_flux)
+
+    def _inverse_transform_inplace(self, X, y):
+        normalise_flux = np.power(10, X[:, self._norm_col], dtype=X.dtype)
+        with np.errstate(over='ignore'):
+            self._unnormalise_array(X, self._x_used, normalise_flux)
+            if y is not None:
+                self._unnormalise_array(y, self._y_used, normalise_flux)
+        X[:, self._norm_col] = normalise_flux
+
     def _check_dataframes(self, X, y):
         if not isinstance(X, pd.DataFrame):
             raise TypeError("X should be pd.DataFrame, was", type(X))
@@ -44,23 +94,56 @@ class LogNormaliser:
         if self.normalise_band not in X.columns:
             raise ValueError(f"Normaliseband ({self.normalise_band}) not in features!")
 
-    def _log_normalise_df(self, df, normalise_flux):
-        if self.copy:
-            df = df.copy()
-        used_bands = ~df.columns.isin(self.ignore_bands)
-        df.loc[:, used_bands] = (df.loc[:, used_bands]
-                                    .divide(normalise_flux, axis=0)
-                                    .apply(np.log10))
-        return df
+    def _check_arrays(self, X, y):
+        if getattr(self, '_x_used', None) is None:
+            raise ValueError("Call set_columns before transforming arrays")
+        if (y is not None) and (self._y_used is None):
+            raise ValueError("No y columns were given to set_columns")
+        X = self._to_float_array(X, self.copy)
+        if X.shape[1] != len(self._x_used):
+            raise ValueError(f"X has {X.shape[1]} columns, expected {len(self._x_used)}")
+        if y is not None:
+            y = self._to_float_array(y, self.copy)
+            if y.shape[1] != len(self._y_used):
+                raise ValueError(f"y has {y.shape[1]} columns, expected {len(self._y_used)}")
+        return X, y
+
+    @staticmethod
+    def _to_float_array(arr, copy):
+        arr = np.asarray(arr)
+        if arr.dtype.kind != 'f':
+            return arr.astype(np.float64)
+        if copy or not arr.flags.writeable:
+            return arr.copy()
+        return arr
+
+    def _get_arrays(self, X, y):
+        X_arr = self._to_float_array(X.values, True)
+        y_arr = None if y is None else self._to_float_array(y.values, True)
+        return X_arr, y_arr
+
+    def _to_dataframes(self, X, y, X_arr, y_arr):
+        X = self._to_dataframe(X, X_arr)
+        if y is not None:
+            return X, self._to_dataframe(y, y_arr)
+        return X
 
-    def _unnormalise_df(self, df, normalise_flux):
+    def _to_dataframe(self, df, arr):
         if self.copy:
-            df = df.copy()
-        used_bands = ~df.columns.isin(self.ignore_bands)
-        df.loc[:, used_bands] = (np.power(10, df.loc[:, used_bands])
-                                    .multiply(normalise_flux, axis=0))
+            return pd.DataFrame(arr, index=df.index, columns=df.columns, copy=False)
+        df.loc[:, :] = arr
         return df
 
+    @staticmethod
+    def _log_normalise_array(arr, used_bands, normalise_flux):
+        np.divide(arr, normalise_flux[:, np.newaxis], out=arr, where=used_bands)
+        np.log10(arr, out=arr, where=used_bands)
+
+    @staticmethod
+    def _unnormalise_array(arr, used_bands, normalise_flux):
+        np.power(10, arr, out=arr, where=used_bands)
+        np.multiply(arr, normalise_flux[:, np.newaxis], out=arr, where=used_bands)
+
 class FeatureSelect:
     uvmir_bands = ['GALEX_FUV', 'GALEX_NUV', 'SDSS_u', 'SDSS_g', 'SDSS_r', 
                    'SDSS_i', 'SDSS_z', '2MASS_J', '2MASS_H', '2MASS_Ks', 
@@ -81,9 +164,26 @@ class FeatureSelect:
         + 14 UV-MIR log(F_obserr / F_bay)
         """
 
-        df = cls.add_features(None, d_data, cls.uvmir_bands, 'shortbay')
-        df = cls.add_features(df, d_data, cls.uvmir_bands, 'obs_to_short')
-        return cls.add_features(df, d_data, cls.uvmir_bands, 'obserr_to_short')
+        bands = cls.uvmir_bands
+        if isinstance(d_data, GalaxyTable):
+            index = d_data.index
+            li_fluxes = [d_data.select(simname, bands) for simname in
+                         ['shortbay', 'observed', 'observederr']]
+        else:
+            index = d_data['shortbay'].index
+            li_fluxes = [d_data[simname].reindex(index=index, columns=bands).values
+                         for simname in ['shortbay', 'observed', 'observederr']]
+        features = uncertainty_features(*li_fluxes)
+        return pd.DataFrame(features, index=index, columns=cls.xunc_columns(),
+                            copy=False)
+
+    @classmethod
+    def xunc_columns(cls):
+        """The column names of `select_xunc`"""
+
+        bands = cls.uvmir_bands
+        return (bands + [f'obs_to_short_{band}' for band in bands] +
+                [f'obserr_to_short_{band}' for band in bands])
 
     @classmethod
     def select_y(cls, d_data):
@@ -109,9 +209,14 @@ class FeatureSelect:
 
         Notes
         -----
-        `df` is modified (not copied), and returned again.
+        `df` is modified (not copied), and returned again. If `d_data` is a
+        `GalaxyTable`, the features are sliced from its blocks instead: a
+        read-only view if `df` is None and the features are contiguous,
+        otherwise a new DataFrame.
         """
 
+        if isinstance(d_data, GalaxyTable):
+            return FeatureSelect._add_table_features(df, d_data, li_features, simname)
         if df is None:
             df = pd.DataFrame()
         # Select features
@@ -120,4 +225,19 @@ class FeatureSelect:
             if featurename in df.columns:
                 featurename = f'{simname}_{featurename}'
             df[featurename] = featureval
-        return df
\ No newline at end of file
+        return df
+
+    @staticmethod
+    def _add_table_features(df, table, li_features, simname):
+        values = table.select(simname, li_features)
+        if df is None:
+            if np.may_share_memory(values, table.select(simname)):
+                # Zero-copy view of the table: do not let it be modified in place
+                values = values.view()
+                values.flags.writeable = False
+            return pd.DataFrame(values, index=table.index, columns=li_features,
+                                copy=False)
+        columns = [f'{simname}_{featurename}' if featurename in df.columns
+                   else featurename for featurename in li_features]
+        return pd.DataFrame(np.hstack([df.values, values]), index=df.index,
+                            columns=list(df.columns) + columns)
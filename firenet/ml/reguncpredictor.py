@@ -58,6 +58,12 @@ class RegUncPredictor:
         Z_pred = self.unc.predict(X_unc)
         return Y_pred, 1 / np.sqrt(Z_pred)
 
+    def get_engine(self, dtype=np.float32):
+        """Export both models as a low-latency `RegUncEngine`"""
+
+        from .inference import RegUncEngine
+        return RegUncEngine.from_predictor(self, dtype=dtype)
+
     def get_target_set(self, tset='test', to_err=True):
         """
         Get Y_true, Y_pred, Y_unc for the given set (train or test).
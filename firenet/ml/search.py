@@ -0,0 +1,282 @@
+"""
+Hyperparameter search over the kwargs of `default_skorch_nnet`
+(`hidden_layer_sizes`, `activation`, `outact`, `lr`, `optimizer__weight_decay`,
+`lr_policy`, ...), on one train/test split.
+"""
+import copy
+import hashlib
+import json
+import sqlite3
+import time
+import numpy as np
+import pandas as pd
+import skorch
+from sklearn.model_selection import ParameterGrid, ParameterSampler
+from .parallel import ordered_parallel_map, thread_limits
+from .singlepredictor import SingleUncertaintyEstimator
+from .util import get_neuralnetregressor
+
+def trial_id(params):
+    """Identifier of a set of hyperparameters (the same in every run)"""
+
+    encoded = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha1(encoded.encode()).hexdigest()[:12]
+
+class Leaderboard:
+    """
+    SQLite file with the trials of a search (table 'trials') and the
+    validation losses they reached at each rung (table 'rungs'). It can be
+    shared by several processes.
+    """
+
+    FINISHED = ('done', 'stopped', 'failed')
+
+    def __init__(self, path='./models/search.sqlite'):
+        self.path = str(path)
+        with self._connect() as con:
+            con.execute('CREATE TABLE IF NOT EXISTS trials (trial_id TEXT PRIMARY KEY, '
+                        'params TEXT, status TEXT, n_epochs INTEGER, '
+                        'best_valid_loss REAL, score REAL, metrics TEXT, '
+                        'duration REAL, error TEXT)')
+            con.execute('CREATE TABLE IF NOT EXISTS rungs (trial_id TEXT, rung INTEGER, '
+                        'valid_loss REAL, PRIMARY KEY (trial_id, rung))')
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=60)
+
+    def finished_trials(self):
+        """Ids of the trials that are done, stopped early or failed"""
+
+        with self._connect() as con:
+            rows = con.execute('SELECT trial_id FROM trials WHERE status IN (?, ?, ?)',
+                               self.FINISHED).fetchall()
+        return {row[0] for row in rows}
+
+    def start_trial(self, trial_id, params):
+        """Register a (re)started trial, forgetting its earlier rungs"""
+
+        with self._connect() as con:
+            con.execute('INSERT OR REPLACE INTO trials (trial_id, params, status) '
+                        'VALUES (?, ?, ?)',
+                        (trial_id, json.dumps(params, sort_keys=True, default=str),
+                         'running'))
+            con.execute('DELETE FROM rungs WHERE trial_id = ?', (trial_id,))
+
+    def record_rung(self, trial_id, rung, valid_loss):
+        """Add a rung result. Returns the losses of all trials at this rung."""
+
+        with self._connect() as con:
+            con.execute('INSERT OR REPLACE INTO rungs VALUES (?, ?, ?)',
+                        (trial_id, rung, valid_loss))
+            rows = con.execute('SELECT valid_loss FROM rungs WHERE rung = ?',
+                               (rung,)).fetchall()
+        return [row[0] for row in rows]
+
+    def finish_trial(self, trial_id, status, n_epochs=None, best_valid_loss=None,
+                     score=None, metrics=None, duration=None, error=None):
+        with self._connect() as con:
+            con.execute('UPDATE trials SET status = ?, n_epochs = ?, best_valid_loss = ?, '
+                        'score = ?, metrics = ?, duration = ?, error = ? '
+                        'WHERE trial_id = ?',
+                        (status, n_epochs, best_valid_loss, score,
+                         json.dumps(metrics), duration, error, trial_id))
+
+    def to_frame(self):
+        """The trials as a DataFrame, best score first"""
+
+        with self._connect() as con:
+            df = pd.read_sql_query('SELECT * FROM trials', con, index_col='trial_id')
+        return df.sort_values('score', na_position='last')
+
+    def to_csv(self, filename):
+        self.to_frame().to_csv(filename)
+
+class ASHAStopper(skorch.callbacks.Callback):
+    """
+    Asynchronous successive halving: at the rungs (after min_epochs,
+    min_epochs * eta, min_epochs * eta^2, ... epochs), the best validation
+    loss of the trial is compared to those of all trials that reached the
+    rung so far (in the leaderboard). Unless it is in the best 1 / eta of
+    them, training stops.
+    """
+
+    def __init__(self, leaderboard_path, trial_id, min_epochs=10, eta=3):
+        super(ASHAStopper, self).__init__()
+        self.leaderboard_path = leaderboard_path
+        self.trial_id = trial_id
+        self.min_epochs = min_epochs
+        self.eta = eta
+
+    def on_train_begin(self, net, X=None, y=None, **kwargs):
+        self.stopped_epoch_ = None
+
+    def on_epoch_end(self, net, **kwargs):
+        epoch = len(net.history)
+        rung = np.log(epoch / self.min_epochs) / np.log(self.eta)
+        if (epoch < self.min_epochs or epoch >= net.max_epochs
+                or not np.isclose(rung, np.round(rung))):
+            return
+        valid_loss = min(net.history[:, 'valid_loss'])
+        losses = Leaderboard(self.leaderboard_path).record_rung(
+            self.trial_id, int(np.round(rung)), valid_loss)
+        n_promoted = len(losses) // self.eta
+        if n_promoted > 0 and valid_loss > sorted(losses)[n_promoted - 1]:
+            self.stopped_epoch_ = epoch
+            if net.verbose:
+                print(f'Stopping trial {self.trial_id} at rung {int(np.round(rung))}.')
+            raise KeyboardInterrupt
+
+class HyperparameterSearch:
+    """
+    Grid or random search over the kwargs of `default_skorch_nnet`, for the
+    regressor or the uncertainty estimator of a `RegUncPredictor`, with
+    ASHA early stopping of poor trials. Trials run in a pool of processes and
+    are recorded in a `Leaderboard`, so an interrupted search continues where
+    it stopped when it is run again (finished trials are skipped).
+
+    The score is the mean validation RMSE (regressor) or the mean validation
+    negative log-likelihood (uncertainty estimator, before the unit chi^2
+    correction). Lower is better. The validation set is the skorch validation
+    split of the training set, so the test set is not used.
+
+    Parameters
+    ----------
+    predictor : RegUncPredictor
+        Preprocessed predictor, e.g. `FullSetPredictor.predictors[i]` for fold
+        i. For target 'unc', its regressor should be trained.
+    param_space : dict or list of dicts
+        As for sklearn's ParameterGrid / ParameterSampler, e.g.
+        {'hidden_layer_sizes': [[100, 100], [200, 200]], 'lr': [1e-3, 1e-2]}.
+    target : 'reg' or 'unc', default 'reg'
+    n_iter : int or None, default None
+        If None, search the full grid. Otherwise, sample n_iter sets.
+    base_kwargs : dict or None, default None
+        kwargs for every trial (e.g. max_epochs, engine).
+    leaderboard : path, default './models/search.sqlite'
+    asha : bool, default True
+        Stop poor trials early (see `ASHAStopper`).
+    min_epochs, eta : int, default 10, 3
+        The ASHA rungs.
+    seed : int or None, default 0
+        Seed of the parameter sampling and of torch in each trial.
+    """
+
+    def __init__(self, predictor, param_space, target='reg', n_iter=None,
+                 base_kwargs=None, leaderboard='./models/search.sqlite', asha=True,
+                 min_epochs=10, eta=3, seed=0):
+        if target not in ['reg', 'unc']:
+            raise ValueError(f"target should be 'reg' or 'unc', was {target}")
+        if target == 'unc' and predictor.reg.model is None:
+            raise ValueError("Searching the uncertainty estimator requires a "
+                             "trained regressor.")
+        self.predictor = predictor
+        self.param_space = param_space
+        self.target = target
+        self.n_iter = n_iter
+        self.base_kwargs = {} if base_kwargs is None else dict(base_kwargs)
+        self.leaderboard_path = str(leaderboard)
+        self.asha = asha
+        self.min_epochs = min_epochs
+        self.eta = eta
+        self.seed = seed
+
+    def get_trials(self):
+        """All (trial_id, params) of the search"""
+
+        if self.n_iter is None:
+            li_params = ParameterGrid(self.param_space)
+        else:
+            li_params = ParameterSampler(self.param_space, self.n_iter,
+                                         random_state=self.seed)
+        return [(trial_id(params), params) for params in li_params]
+
+    def run(self, n_jobs=1, n_threads=None, verbose=True):
+        """
+        Run the trials that are not in the leaderboard yet. Returns the
+        leaderboard as a DataFrame.
+
+        Parameters
+        ----------
+        n_jobs : int, default 1
+            Number of trials trained in parallel, each in its own process.
+        n_threads : int or None, default None
+            Torch and BLAS threads per trial (see `ml.parallel.thread_limits`;
+            restored after sequential runs).
+        """
+
+        leaderboard = Leaderboard(self.leaderboard_path)
+        finished = leaderboard.finished_trials()
+        trials = [trial for trial in self.get_trials() if trial[0] not in finished]
+        if verbose:
+            print(f'{len(trials)} trials to run ({len(finished)} finished before)')
+        if n_jobs == 1:
+            with thread_limits(n_threads):
+                results = list(map(self.run_trial, trials))
+        else:
+            results = ordered_parallel_map(self, 'run_trial', trials, n_jobs,
+                                           n_threads=n_threads)
+        for i, (tid, status, score) in enumerate(results):
+            if verbose:
+                print(f'Trial {i+1}/{len(trials)} ({tid}): {status}, score {score}')
+        return leaderboard.to_frame()
+
+    def run_trial(self, trial):
+        """Train and score one (trial_id, params). Returns id, status, score."""
+
+        import torch
+
+        tid, params = trial
+        leaderboard = Leaderboard(self.leaderboard_path)
+        leaderboard.start_trial(tid, params)
+        kwargs = dict(self.base_kwargs, **params)
+        kwargs.setdefault('verbose', False)
+        start = time.perf_counter()
+        try:
+            if self.seed is not None:
+                torch.manual_seed(self.seed)
+            single = self._train(tid, kwargs)
+        except Exception as e:
+            leaderboard.finish_trial(tid, 'failed', duration=time.perf_counter() - start,
+                                     error=repr(e))
+            return tid, 'failed', None
+        net = self._fitted_net(single.model)
+        stopper = [cb for _, cb in net.callbacks_ if isinstance(cb, ASHAStopper)]
+        status = 'stopped' if stopper and stopper[0].stopped_epoch_ else 'done'
+        metrics = self._get_metrics(single)
+        score = metrics['rmse' if self.target == 'reg' else 'nll']
+        leaderboard.finish_trial(tid, status, n_epochs=len(net.history),
+                                 best_valid_loss=min(net.history[:, 'valid_loss']),
+                                 score=score, metrics=metrics,
+                                 duration=time.perf_counter() - start)
+        return tid, status, score
+
+    def _train(self, tid, kwargs):
+        # Train a copy, leaving the predictor untouched
+        if self.target == 'reg':
+            single = copy.copy(self.predictor.reg)
+        else:
+            reg = self.predictor.reg
+            single = SingleUncertaintyEstimator(self.predictor.d_data)
+            single.preprocess(idx_train=reg.X_train.index, idx_test=reg.X_test.index,
+                              Y_pred=reg.Y_pred)
+        model = single._get_default_model(**kwargs)
+        if self.asha:
+            net = get_neuralnetregressor(model)
+            net.callbacks = list(net.callbacks) + [
+                ASHAStopper(self.leaderboard_path, tid, self.min_epochs, self.eta)]
+        single.train(model=model, apply_correction=False)
+        return single
+
+    def _get_metrics(self, single):
+        metrics = {'rmse' if self.target == 'reg' else 'mean_chisq':
+                   float(single.test(tset='val').mean())}
+        if self.target == 'unc':
+            Y_diff_sq, Z = single.get_target_set('val', to_err=False)
+            metrics['nll'] = float(np.mean(Y_diff_sq.values * Z.values - np.log(Z.values)))
+        return metrics
+
+    @staticmethod
+    def _fitted_net(model):
+        net = model.steps[-1][1]
+        # The fitted clone of a TransformedTargetRegressor
+        return getattr(net, 'regressor_', net)
@@ -24,6 +24,8 @@ class SinglePredictor(ABC):
     Either a regressor or uncertainty estimator. """
 
     def __init__(self, d_data):
+        """d_data: dict of DataFrames, `GalaxyTable`, or None (load pickle)"""
+
         if d_data is None:
             with open('./data/d_data.pkl', 'rb') as ddf_file:
                 d_data = pickle.load(ddf_file)
@@ -199,7 +201,7 @@ class SinglePredictor(ABC):
         if 'neuralnet' in self.model.named_steps:
             split = self.model.named_steps['neuralnet'].train_split(self.X_train)
         elif 'neuralnet_scaled' in self.model.named_steps:
-            split = self.model.named_steps['neuralnet'].regressor.train_split(self.X_train)
+            split = self.model.named_steps['neuralnet_scaled'].regressor_.train_split(self.X_train)
         else:
             raise ValueError("tr or val set requires a 'neuralnet' or 'neuralnet_scaled' "
                              "in the pipeline")
@@ -0,0 +1,249 @@
+"""
+Predict the FIR SED of a galaxy catalogue, streaming it in chunks.
+
+The input table (CSV, Parquet or FITS) has, for each of the 14 UV-MIR bands
+(`FeatureSelect.uvmir_bands`), the columns
+
+    shortbay_<band>, observed_<band>, observederr_<band>
+
+with the Bayesian UV-MIR SED fit fluxes, and the observed fluxes and their
+uncertainties (missing observations may be empty/nan). The fluxes are in W/Hz,
+or in mJy with `--mjy` (which requires a `redshift` column). Each chunk goes
+through the same steps as notebook 04 (uncertainty features, log
+normalisation, prediction, inverse normalisation), and the output (CSV or
+Parquet) gets, for each FIR band, the predicted flux and its uncertainty (dex):
+
+    <band>, <band>_err
+
+Example:
+
+    python -m firenet.predict catalogue.fits predictions.csv --model nnet_alldata
+
+With `--n-jobs`, the chunks are predicted in a pool of worker processes (see
+`ml.parallel.ordered_parallel_map`), and written in order.
+"""
+import argparse
+import time
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from .ml.modelstore import ModelStore
+from .ml.parallel import ordered_parallel_map
+from .ml.preprocessing import FeatureSelect, LogNormaliser
+from .units import default_converter
+from .util import uncertainty_features
+
+INPUT_SIMNAMES = ['shortbay', 'observed', 'observederr']
+
+def input_columns(bands=None):
+    """The flux columns of the input catalogue"""
+
+    bands = FeatureSelect.uvmir_bands if bands is None else bands
+    return [f'{simname}_{band}' for simname in INPUT_SIMNAMES for band in bands]
+
+class CataloguePredictor:
+    """
+    Applies an inference engine (see `ModelStore.load_engine`) to chunks of a
+    flux catalogue.
+
+    Parameters
+    ----------
+    engine : RegUncEngine or EnsembleRegUncEngine
+    mjy : bool, default False
+        If True, the input fluxes are in mJy and the predictions are returned
+        in mJy, using the 'redshift' column of the chunks.
+    preprocessing : dict or None, default None
+        The columns and normalisation of the model (see
+        `ModelStore.load_preprocessing`). If None, those of
+        `SinglePredictor.preprocess` by default.
+    """
+
+    def __init__(self, engine, mjy=False, preprocessing=None):
+        self.engine = engine
+        self.mjy = mjy
+        self.uvmir_bands = list(FeatureSelect.uvmir_bands)
+        self.fir_bands = list(FeatureSelect.fir_bands)
+        xunc_columns = FeatureSelect.xunc_columns()
+        if preprocessing is None:
+            # As in SinglePredictor.preprocess: only fluxes are normalised
+            preprocessing = {
+                'reg': {'x_columns': self.uvmir_bands, 'y_columns': self.fir_bands,
+                        'normaliser': {}},
+                'unc': {'x_columns': xunc_columns, 'y_columns': self.fir_bands,
+                        'normaliser': {'ignore_bands': xunc_columns[len(self.uvmir_bands):]}}}
+        for key, x_columns in [('reg', self.uvmir_bands), ('unc', xunc_columns)]:
+            if (list(preprocessing[key]['x_columns']) != x_columns
+                    or list(preprocessing[key]['y_columns']) != self.fir_bands):
+                raise ValueError(f"The {key} model has other features or targets than "
+                                 "the catalogue predictor")
+        self.reg_normaliser = (LogNormaliser(**preprocessing['reg']['normaliser'], copy=False)
+                               .set_columns(self.uvmir_bands, self.fir_bands))
+        self.unc_normaliser = (LogNormaliser(**preprocessing['unc']['normaliser'], copy=False)
+                               .set_columns(xunc_columns))
+        self.output_columns = self.fir_bands + [f'{band}_err' for band in self.fir_bands]
+
+    def predict_chunk(self, chunk):
+        """
+        Predict on a DataFrame with the input columns. Returns a DataFrame with
+        the same index and the output columns.
+        """
+
+        n_bands = len(self.uvmir_bands)
+        fluxes = chunk[input_columns(self.uvmir_bands)].values.astype(np.float64)
+        if self.mjy:
+            fluxes = default_converter.mjy_to_luminosity(fluxes, chunk['redshift'].values)
+        shortbay = fluxes[:, :n_bands]
+        X_unc = uncertainty_features(shortbay, fluxes[:, n_bands:2*n_bands],
+                                     fluxes[:, 2*n_bands:])
+        X_reg = self.reg_normaliser.transform_array(shortbay)
+        X_unc = self.unc_normaliser.transform_array(X_unc)
+        Y_pred, Y_unc = self.engine.predict(X_reg, X_unc)[:2]
+        # Log normalised -> W/Hz (X_reg is only needed for the normalise band)
+        _, F_pred = self.reg_normaliser.inverse_transform_array(X_reg, Y_pred)
+        if self.mjy:
+            F_pred = default_converter.luminosity_to_mjy(F_pred, chunk['redshift'].values)
+        return pd.DataFrame(np.hstack([F_pred, Y_unc]), index=chunk.index,
+                            columns=self.output_columns)
+
+def iter_catalogue(filename, columns, chunksize=100000, id_column=None):
+    """
+    Iterate over chunks (DataFrames) of a CSV, Parquet or FITS table, reading
+    only `columns` (and the `id_column`, used as index). Without `id_column`,
+    the index is the row number in the file.
+    """
+
+    filename = Path(filename)
+    suffix = filename.suffix.lower()
+    usecols = list(columns) + ([id_column] if id_column is not None else [])
+    if suffix in ['.fits', '.fit', '.fts']:
+        from astropy.io import fits
+        with fits.open(filename, memmap=True) as hdulist:
+            data = hdulist[1].data
+            for start in range(0, len(data), chunksize):
+                rows = data[start:start+chunksize]
+                chunk = pd.DataFrame({col: np.asarray(rows[col]).astype(np.float64)
+                                      for col in columns},
+                                     index=pd.RangeIndex(start, start + len(rows)))
+                if id_column is not None:
+                    ids = np.asarray(rows[id_column])
+                    if ids.dtype.kind == 'S':
+                        ids = np.char.strip(ids.astype(str))
+                    chunk.index = pd.Index(ids, name=id_column)
+                yield chunk
+            del data
+    elif suffix == '.parquet':
+        import pyarrow.parquet as pq
+        parquetfile = pq.ParquetFile(filename)
+        start = 0
+        for batch in parquetfile.iter_batches(batch_size=chunksize, columns=usecols):
+            chunk = batch.to_pandas()
+            if id_column is not None:
+                chunk = chunk.set_index(id_column)
+            else:
+                chunk.index = pd.RangeIndex(start, start + len(chunk))
+            start += len(chunk)
+            yield chunk
+    else:
+        reader = pd.read_csv(filename, usecols=usecols, chunksize=chunksize,
+                             index_col=id_column)
+        yield from reader
+
+class CatalogueWriter:
+    """Appends chunks (DataFrames) to a CSV or Parquet file"""
+
+    def __init__(self, filename):
+        self.filename = Path(filename)
+        self.is_parquet = self.filename.suffix.lower() == '.parquet'
+        if not self.is_parquet and self.filename.suffix.lower() != '.csv':
+            raise ValueError(f'Output {filename} should be a .csv or .parquet file')
+        self._writer = None
+        self._n_chunks = 0
+
+    def write(self, chunk):
+        if self.is_parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pandas(chunk)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.filename, table.schema)
+            self._writer.write_table(table)
+        else:
+            chunk.to_csv(self.filename, mode='w' if self._n_chunks == 0 else 'a',
+                         header=self._n_chunks == 0)
+        self._n_chunks += 1
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def predict_chunks(predictor, chunks, n_jobs=1, n_threads=None):
+    """
+    Predict on an iterable of chunks, yielding the predictions in order. If
+    n_jobs > 1, use a pool of worker processes, with `n_threads` threads each.
+    """
+
+    if n_jobs == 1:
+        for chunk in chunks:
+            yield predictor.predict_chunk(chunk)
+    else:
+        yield from ordered_parallel_map(predictor, 'predict_chunk', chunks,
+                                        n_jobs, n_threads=n_threads)
+
+def predict_catalogue(infile, outfile, model='nnet_alldata', modeldir='./models/',
+                      chunksize=100000, id_column=None, mjy=False, n_jobs=1,
+                      n_threads=None, verbose=True):
+    """
+    Predict on a catalogue file, writing the predictions chunk by chunk (see
+    the module docstring for the columns). Returns the number of galaxies.
+    """
+
+    store = ModelStore(modeldir)
+    predictor = CataloguePredictor(store.load_engine(model), mjy=mjy,
+                                   preprocessing=store.load_preprocessing(model))
+    columns = input_columns() + (['redshift'] if mjy else [])
+    chunks = iter_catalogue(infile, columns, chunksize, id_column)
+    n_galaxies = 0
+    start = time.perf_counter()
+    with CatalogueWriter(outfile) as writer:
+        for predictions in predict_chunks(predictor, chunks, n_jobs, n_threads):
+            writer.write(predictions)
+            n_galaxies += len(predictions)
+            if verbose:
+                print(f'{n_galaxies} galaxies ({time.perf_counter() - start:.1f} s)')
+    return n_galaxies
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m firenet.predict',
+        description='Predict the FIR fluxes of a catalogue with a stored FIRE-net model.')
+    parser.add_argument('infile', help='input catalogue (.csv, .parquet or .fits)')
+    parser.add_argument('outfile', help='output predictions (.csv or .parquet)')
+    parser.add_argument('--model', default='nnet_alldata',
+                        help='name of the model in the model directory')
+    parser.add_argument('--modeldir', default='./models/')
+    parser.add_argument('--chunksize', type=int, default=100000,
+                        help='number of galaxies per chunk')
+    parser.add_argument('--id-column', default=None,
+                        help='column with the galaxy ids (used as index)')
+    parser.add_argument('--mjy', action='store_true',
+                        help='fluxes in mJy (requires a redshift column)')
+    parser.add_argument('--n-jobs', type=int, default=1,
+                        help='number of worker processes')
+    parser.add_argument('--n-threads', type=int, default=None,
+                        help='BLAS threads per worker (default: CPUs / n-jobs)')
+    parser.add_argument('--quiet', action='store_true')
+    args = parser.parse_args(argv)
+    predict_catalogue(args.infile, args.outfile, model=args.model,
+                      modeldir=args.modeldir, chunksize=args.chunksize,
+                      id_column=args.id_column, mjy=args.mjy,
+                      n_jobs=args.n_jobs, n_threads=args.n_threads,
+                      verbose=not args.quiet)
+
+if __name__ == '__main__':
+    main()
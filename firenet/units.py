@@ -0,0 +1,145 @@
+"""
+Conversion between flux (mJy) and luminosity (W/Hz), without K-correction
+(see e.g. Hogg 2000):
+
+    L_{(1+z)nu} = 4 pi D_L^2 S_nu / (1+z)
+"""
+import hashlib
+import numpy as np
+import pandas as pd
+from .fluxing.filters.helpers import LRUCache
+
+MJY_TO_SI = 1e-29  # mJy to W/m^2/Hz
+
+def redshift_fingerprint(redshift):
+    """sha1 hex digest of redshifts (and the index, for a pd.Series)"""
+
+    sha1 = hashlib.sha1()
+    if isinstance(redshift, pd.Series):
+        sha1.update('\n'.join(map(str, redshift.index)).encode())
+    sha1.update(np.ascontiguousarray(redshift, dtype=np.float64).tobytes())
+    return sha1.hexdigest()
+
+class LuminosityConverter:
+    """
+    Converts blocks of fluxes (mJy) to luminosities (W/Hz) and back.
+
+    The luminosity distance is interpolated from a lookup table, which is
+    computed with astropy once per cosmology (and extended when larger
+    redshifts are requested). D_L / z is smooth, so linear interpolation on
+    the default grid has a relative error of about 1e-6. The conversion factor
+    of every galaxy is cached per redshift table.
+
+    Parameters
+    ----------
+    cosmology : astropy.cosmology.Cosmology or None, default None
+        If None, use Planck15 (as in notebook 01).
+    z_step : float, default 1e-3
+        Step of the redshift grid of the lookup table.
+    """
+
+    # (cosmology, z_step) -> (z grid, D_L / z in m)
+    _tables = {}
+
+    def __init__(self, cosmology=None, z_step=1e-3):
+        if cosmology is None:
+            from astropy.cosmology import Planck15 as cosmology
+        self.cosmology = cosmology
+        self.z_step = z_step
+        self._factor_cache = LRUCache(maxsize=16)
+
+    def luminosity_distance(self, redshift):
+        """Luminosity distance (m) at one or more redshifts"""
+
+        redshift = np.asarray(redshift, dtype=np.float64)
+        z_grid, dl_over_z = self._get_table(redshift)
+        return redshift * np.interp(redshift, z_grid, dl_over_z)
+
+    def factor(self, redshift):
+        """
+        The factor 4 pi D_L^2 / (1+z) from mJy to W/Hz.
+
+        Parameters
+        ----------
+        redshift : pd.Series or array
+            The redshift of every galaxy.
+
+        Returns
+        -------
+        factor : pd.Series or array
+            Same type and index as `redshift`.
+        """
+
+        values = np.asarray(redshift, dtype=np.float64)
+        key = redshift_fingerprint(redshift)
+        if key not in self._factor_cache:
+            dist_lum = self.luminosity_distance(values)
+            factor = 4*np.pi*np.square(dist_lum)*MJY_TO_SI / (1+values)
+            factor.flags.writeable = False
+            self._factor_cache[key] = factor
+        factor = self._factor_cache[key]
+        if isinstance(redshift, pd.Series):
+            return pd.Series(factor, index=redshift.index)
+        return factor
+
+    def mjy_to_luminosity(self, fluxes, redshift):
+        """
+        Flux (mJy) to luminosity (W/Hz).
+
+        Parameters
+        ----------
+        fluxes : pd.DataFrame or array, shape (n_galaxies, n_bands)
+            All columns are converted at once.
+        redshift : pd.Series or array
+            If a Series and `fluxes` is a DataFrame, it is aligned on the
+            index of `fluxes`. Otherwise, it matches the rows of `fluxes`.
+        """
+
+        return self._apply(fluxes, redshift, np.multiply)
+
+    def luminosity_to_mjy(self, luminosities, redshift):
+        """
+        Luminosity (W/Hz) to flux (mJy), e.g. for the output of
+        `LogNormaliser.inverse_transform`. See `mjy_to_luminosity`.
+        """
+
+        return self._apply(luminosities, redshift, np.divide)
+
+    def _apply(self, data, redshift, ufunc):
+        if isinstance(data, pd.DataFrame) and isinstance(redshift, pd.Series):
+            redshift = redshift.loc[data.index]
+        factor = np.asarray(self.factor(redshift))
+        values = np.asarray(data, dtype=np.float64)
+        if len(factor) != len(values):
+            raise ValueError('There should be one redshift per galaxy')
+        if values.ndim == 1:
+            result = ufunc(values, factor)
+        else:
+            result = ufunc(values, factor[:, np.newaxis])
+        if isinstance(data, pd.DataFrame):
+            return pd.DataFrame(result, index=data.index, columns=data.columns)
+        if isinstance(data, pd.Series):
+            return pd.Series(result, index=data.index, name=data.name)
+        return result
+
+    def _get_table(self, redshift):
+        if redshift.size > 0 and np.nanmin(redshift) < 0:
+            raise ValueError('Redshifts should be non-negative')
+        z_max = np.nanmax(redshift) if redshift.size > 0 else 0
+        key = (repr(self.cosmology), self.z_step)
+        table = self._tables.get(key)
+        if table is None or table[0][-1] < z_max:
+            # Grow the table geometrically, so it is rebuilt only a few times
+            z_end = max(1., 2*z_max) if table is None else max(2*table[0][-1], 2*z_max)
+            z_grid = np.arange(0, z_end + self.z_step, self.z_step)
+            dist_lum = self.cosmology.luminosity_distance(z_grid[1:]).to('m').value
+            dl_over_z = np.empty(len(z_grid))
+            dl_over_z[1:] = dist_lum / z_grid[1:]
+            # D_L / z -> c / H0 at z = 0
+            dl_over_z[0] = 2*dl_over_z[1] - dl_over_z[2]
+            table = (z_grid, dl_over_z)
+            self._tables[key] = table
+        return table
+
+# Converter for the default cosmology
+default_converter = LuminosityConverter()
@@ -1,16 +1,68 @@
 import numpy as np
+import pandas as pd
+
+# Value of log(F / F_bay) where it is undefined (missing or invalid flux)
+MISSING_LOG_RATIO = 6
+
+def log_ratio(numerator, denominator, out=None):
+    """
+    log10(numerator / denominator), with MISSING_LOG_RATIO where the ratio is
+    nan, infinite or negative. A zero numerator gives -inf.
+
+    Parameters
+    ----------
+    numerator, denominator : array
+    out : array or None, default None
+        Array to write the result into (may be `numerator`).
+    """
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out = np.divide(numerator, denominator, out=out)
+        # inf ratios stay inf (and negative ones become nan) after the log
+        np.log10(out, out=out)
+    out[np.isnan(out) | (out == np.inf)] = MISSING_LOG_RATIO
+    return out
+
+def uncertainty_features(bayesian, observed, observederr, out=None):
+    """
+    The feature matrix of the uncertainty estimator: the Bayesian fluxes,
+    log(F_obs / F_bay) and log(F_obserr / F_bay) (see `log_ratio`).
+
+    Parameters
+    ----------
+    bayesian, observed, observederr : array, shape (n_galaxies, n_bands)
+        Aligned fluxes (same galaxies and bands).
+    out : array or None, default None
+        Array of shape (n_galaxies, 3*n_bands) to write the features into. If
+        None, a float64 array is allocated.
+    """
+
+    bayesian = np.asarray(bayesian)
+    n_bands = bayesian.shape[1]
+    if out is None:
+        out = np.empty((len(bayesian), 3*n_bands))
+    if out.shape != (len(bayesian), 3*n_bands):
+        raise ValueError(f'out has shape {out.shape}, expected '
+                         f'{(len(bayesian), 3*n_bands)}')
+    out[:, :n_bands] = bayesian
+    for i, fluxes in enumerate([observed, observederr], start=1):
+        block = out[:, i*n_bands:(i+1)*n_bands]
+        block[...] = fluxes
+        log_ratio(block, bayesian, out=block)
+    return out
 
 def add_uncertainty_features(d_data):
-    """Add flux error ratio and flux ratio to d_data"""
-
-    d_data['obserr_to_short'] = ((d_data['observederr'] / d_data['shortbay'])
-                                .copy()
-                                .replace([np.inf, -np.inf], np.nan)
-                                .apply(np.log10)
-                                .fillna(6))
-    d_data['obs_to_short'] = ((d_data['observed'] / d_data['shortbay'])
-                                .copy()
-                                .replace([np.inf, -np.inf], np.nan)
-                                .apply(np.log10)
-                                .fillna(6))
-    return d_data
\ No newline at end of file
+    """
+    Add flux error ratio and flux ratio to d_data (a dict of DataFrames or a
+    `GalaxyTable`). Returns a shallow copy: `d_data` itself is not changed.
+    """
+
+    d_data = d_data.copy()
+    shortbay = d_data['shortbay']
+    for name, simname in [('obserr_to_short', 'observederr'),
+                          ('obs_to_short', 'observed')]:
+        # Align as the pandas division would
+        fluxes, bayesian = d_data[simname].align(shortbay, join='outer')
+        d_data[name] = pd.DataFrame(log_ratio(fluxes.values, bayesian.values),
+                                    index=fluxes.index, columns=fluxes.columns)
+    return d_data
@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+import pytest
+from firenet.predict import iter_catalogue
+
+N_ROWS = 25
+CHUNKSIZE = 10
+
+@pytest.fixture
+def catalogue():
+    rng = np.random.RandomState(0)
+    return pd.DataFrame({'id': [f'gal{i}' for i in range(N_ROWS)],
+                         'a': rng.normal(size=N_ROWS), 'b': rng.normal(size=N_ROWS)})
+
+def write_catalogue(df, filename):
+    if filename.suffix == '.fits':
+        from astropy.table import Table
+        Table.from_pandas(df).write(filename)
+    elif filename.suffix == '.parquet':
+        df.to_parquet(filename, index=False)
+    else:
+        df.to_csv(filename, index=False)
+
+@pytest.mark.parametrize('suffix', ['.csv', '.parquet', '.fits'])
+def test_iter_catalogue_index(tmp_path, catalogue, suffix):
+    """Without an id column, the index of the chunks is the row number"""
+
+    filename = tmp_path / f'catalogue{suffix}'
+    write_catalogue(catalogue, filename)
+    chunks = list(iter_catalogue(filename, ['a', 'b'], chunksize=CHUNKSIZE))
+    assert len(chunks) == 3
+    df = pd.concat(chunks)
+    np.testing.assert_array_equal(df.index, np.arange(N_ROWS))
+    np.testing.assert_allclose(df[['a', 'b']].values, catalogue[['a', 'b']].values)
+
+@pytest.mark.parametrize('suffix', ['.csv', '.parquet', '.fits'])
+def test_iter_catalogue_id_column(tmp_path, catalogue, suffix):
+    filename = tmp_path / f'catalogue{suffix}'
+    write_catalogue(catalogue, filename)
+    df = pd.concat(iter_catalogue(filename, ['a', 'b'], chunksize=CHUNKSIZE,
+                                  id_column='id'))
+    assert list(df.index) == list(catalogue['id'])
+    np.testing.assert_allclose(df[['a', 'b']].values, catalogue[['a', 'b']].values)